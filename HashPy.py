@@ -1,14 +1,20 @@
 # =============================================================================
-# Section: Library Imports 
+# Section: Library Imports
 # =============================================================================
-import os, sys, argparse, hashlib, collections, csv, configparser
-from time import localtime, strftime
+import os, sys, argparse, hashlib, collections, csv, configparser, mmap, threading, sqlite3, itertools, queue
+import json, platform, shutil, tempfile, asyncio, struct, re, fnmatch, stat, heapq
+from time import localtime, gmtime, strftime, monotonic, perf_counter, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+try:
+	import blake3								# Optional, enables BLAKE3 hash type
+except ImportError:
+	blake3 = None
 # =============================================================================
 # Section: Basic directory configuration
 # =============================================================================
-# Creation Date and Time directory name - Need to be overwritten when loading
+# Session directories are named after the creation date and time when a
+# Session is created, nothing is computed or created on import.
 # =============================================================================
-session_datetime			=	str(strftime("%Y-%m-%d@%H-%M-%S", localtime()))
 session_local_path			=	os.path.dirname(os.path.realpath(__file__))
 session_main_dir			=	"Sessions"					# Sessions directory name
 session_config_dir			=	"config"					# Session config directory
@@ -16,92 +22,387 @@ session_results_dir			=	"results"					# Session results directory
 session_config_file			=	"hashpy.config"				# Session config file
 session_discovered_list			=	"discovered_files.csv"		# List of discovered files
 session_hashed_list			=	"hashed_files.csv"			# List with hashed files
+session_cache_file			=	"hash_cache.sqlite"			# Hash cache shared by all sessions
+session_duplicates_list			=	"duplicates.csv"			# List of duplicate file groups
+session_index_file			=	"session_index.sqlite"		# Index of hashed files for queries
 # =============================================================================
-config_dir_path = os.path.join(session_local_path,session_main_dir,session_datetime,session_config_dir)
-# Path for config file
-config_file_path = os.path.join(config_dir_path,session_config_file)
-# Path for discovered_files file
-discovered_list_path = os.path.join(config_dir_path,session_discovered_list)
-# Path for hashed files status file  ('hashed_files_status.txt')
-hashed_list_path = os.path.join(config_dir_path,session_hashed_list)
+# Section: Read Engine options
 # =============================================================================
-session_loaded = False 					# Loading session file
-session_loaded_file = None              # Path to the session file
+_small_file_limit = 1024 * 1024				# Files up to 1MB use small chunks
+_medium_file_limit = 64 * 1024 * 1024		# Files up to 64MB use medium chunks
+_small_chunk_size = 64 * 1024
+_medium_chunk_size = 1024 * 1024
+_large_chunk_size = 4 * 1024 * 1024
+_read_buffers = threading.local()			# One reusable read buffer per thread
+# Opening without blocking keeps a FIFO from stopping the hashing
+_read_open_flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_NONBLOCK', 0)
+_fast_path_limit = 64 * 1024				# Files up to 64KB are read in a single call
+_fast_path_batch_files = 64					# Small files hashed per worker task
+_stream_chunk_size = 1024 * 1024			# Bytes requested per read from async streams
+_stream_inline_size = 64 * 1024			# Stream chunks up to this size are hashed on the event loop
 # =============================================================================
-# Section: Script Output Options
+# Section: Hash Types
 # =============================================================================
-session_target_path = None
-session_recursive_search = False
-session_hash_type = "MD5"
-session_verbose_mode = False
+_hash_constructors = collections.OrderedDict([
+	("MD5", hashlib.md5),
+	("SHA1", hashlib.sha1),
+	("SHA224", hashlib.sha224),
+	("SHA256", hashlib.sha256),
+	("SHA384", hashlib.sha384),
+	("SHA512", hashlib.sha512),
+	("BLAKE2B", hashlib.blake2b),
+	("BLAKE2S", hashlib.blake2s),
+])
+if blake3 is not None:
+	_hash_constructors["BLAKE3"] = blake3.blake3
 # =============================================================================
 # Section: Display Adjustment options
 # =============================================================================
-_last_output_length = 0
+_display_interval = 0.1						# Seconds between console status updates
+_entry_type_labels = [						# Discovery counts displayed when not zero
+	("hardlink", "Hardlinked files"),
+	("symlink", "Skipped symlinks"),
+	("fifo", "Skipped FIFOs"),
+	("device", "Skipped devices"),
+	("socket", "Skipped sockets"),
+	("other", "Skipped other files"),
+	("loop", "Skipped link loops"),
+]
 # =============================================================================
-# Section: Output Tracking
+# Section: Output Tracking options
 # =============================================================================
-_discovered_files_count = 0
-_hashed_files_count = 0
+_stream_queue_size = 10000					# Discovered files waiting to be hashed
+_stream_poll_interval = 0.05				# Seconds hashing waits for discovery before checking its jobs
+_scheduler_read_ahead = 20000				# Rows read ahead to keep every device busy
+_scheduler_queue_depth = 4					# Jobs queued per device worker
+_partial_hash_size = 4096					# Bytes read from head and tail for dedupe
+_index_batch_rows = 10000					# Rows inserted per batch when indexing
+_verify_batch_rows = 1000					# Files hashed per batch when verifying
+_cache_commit_interval = 1000				# Cache rows stored between commits
+_cache_commit_seconds = 1.0					# Longest time stored cache rows wait for a commit
+_cache_busy_timeout = 30.0					# Seconds to wait for a cache locked by another session
 # =============================================================================
-# Section: Parser Initialisation
+# Section: Benchmark options
 # =============================================================================
-parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+_bench_tiny_files = 2000					# Many tiny files tree
+_bench_tiny_size = 1024
+_bench_huge_files = 2						# Few huge files tree
+_bench_huge_size = 64 * 1024 * 1024
+_bench_deep_levels = 32						# Deeply nested tree
+_bench_deep_files = 8						# Files per nested directory
+_bench_deep_size = 4096
+_bench_chunk_sizes = [64 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+_bench_csv_rows = 100000					# Rows saved by csv writer benchmark
+# =============================================================================
+# Section: Metrics options
+# =============================================================================
+_metrics_interval = 1.0						# Seconds between metrics snapshots
+# =============================================================================
+# Section: Output Writer options
+# =============================================================================
+_csv_buffer_size = 1024 * 1024				# Write buffer of each csv file
+_csv_flush_rows = 1000						# Rows held in memory before flushing
+_csv_flush_seconds = 2.0					# Time between flushes
+_csv_fsync_seconds = 30.0					# Time between checkpoints to disk
+_list_extensions = {"csv": ".csv", "binary": ".hpb"}	# Session list file extension per format
+_binary_file_magic = b"HASHPYB2"			# Start of a binary list, followed by the header
+_binary_block_magic = b"HPBK"				# Start of every block of rows
+_binary_block_header = struct.Struct("<4sIIH")	# Magic, rows, payload length, hash columns
+_binary_block_rows = 4096					# Rows per block when converting lists
 # =============================================================================
 # Section: Argparse Validation Functions
 # =============================================================================
+# Validators raise InvalidSettingError, a ValueError for code using Hasher and
+# Session that argparse also reports as a usage error. Messages tell apart
+# values provided by the user and values loaded from a session config
+# (loaded = True), run_app() ends the script for the latter.
+# =============================================================================
+# =============================================================================
+# Name:       InvalidSettingError(message)
+# Purpose:    Raised for invalid settings of a Hasher or Session
+# =============================================================================
+class InvalidSettingError(ValueError, argparse.ArgumentTypeError):
+	pass
+# =============================================================================
+# Name:       is_session_config(system_path)
+# Arguments:  system_path = validated target
+# Purpose:    Returns True if target is a HashPy.config session file to be loaded
 # =============================================================================
-# Name:       validate_target(path_string)
+def is_session_config(system_path):
+	return os.path.isfile(system_path) and os.path.basename(system_path) == session_config_file
+# =============================================================================
+# Name:       validate_target(path_string, loaded)
 # Arguments:  path_string = string input from the user to hash
+#             loaded = True if value was loaded from a session config
 # Purpose:    Returns a valid path value or raises error
 # =============================================================================
-def validate_target(system_path):
-	global session_loaded, session_loaded_file
-
-	# Check if system_path is a file or a directory
+def validate_target(system_path, loaded=False):
+	# Check if system_path is a file (or HashPy.config session file) or a directory
 	if os.path.isfile(system_path):
-		#Check if file is HashPy.config session file
-		if (os.path.basename(system_path) == session_config_file):
-			# system path is a session config file to be loaded
-			session_loaded = True
-			return system_path
-		else:
-			return system_path
+		return system_path
 	elif (os.path.isdir(system_path)):
 		# system path is a directory
 		return system_path
 	else:
-		if(session_loaded == True):
-			print('\n>>>>> Loaded target is not a valid file or directory!\n')
-			sys.exit(1)
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded target is not a valid file or directory!\n')
 		else:
-			raise argparse.ArgumentTypeError('\n>>>>> Provided target is not a valid file or directory!\n')
+			raise InvalidSettingError('\n>>>>> Provided target is not a valid file or directory!\n')
 # =============================================================================
 # =============================================================================
-# Name:       validate_hash_type(hash_type)
-# Arguments:  hash_type = a string representing type of hash to be used
+# Name:       validate_hash_type(hash_type, loaded)
+# Arguments:  hash_type = a string representing type of hash to be used, several
+#             hash types can be separated with commas e.g. "MD5,SHA256"
+#             loaded = True if value was loaded from a session config
 # Purpose:    Returns a hash type or raises error
 # =============================================================================
-def validate_hash_type(hash_type):
-	possible_hashes = ["MD5", "SHA1", "SHA224", "SHA256", "SHA384", "SHA512"]
-	hash_type = hash_type.upper() # converts characters to upper case to match list
+def validate_hash_type(hash_type, loaded=False):
+	possible_hashes = list(_hash_constructors)
+	hash_types = []
+	for single_type in hash_type.upper().split(","): # converts characters to upper case to match list
+		single_type = single_type.strip()
+		if single_type not in hash_types:
+			hash_types.append(single_type)
+
+	if all(single_type in possible_hashes for single_type in hash_types):
+		return ",".join(hash_types)
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded hash is not a valid or supported hash type!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided hash is not a valid or supported hash type!\n')
+# =============================================================================
+# Name:       validate_workers(workers, loaded)
+# Arguments:  workers = a string representing number of hashing workers
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns a positive number of workers or raises error
+# =============================================================================
+def validate_workers(workers, loaded=False):
+	try:
+		workers = int(workers)
+	except (TypeError, ValueError):
+		workers = 0
+
+	if workers >= 1:
+		return workers
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded number of workers is not a positive integer!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided number of workers is not a positive integer!\n')
+# =============================================================================
+# Name:       validate_pool_type(pool_type, loaded)
+# Arguments:  pool_type = a string representing type of worker pool
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns a pool type or raises error
+# =============================================================================
+def validate_pool_type(pool_type, loaded=False):
+	possible_pools = ["thread", "process"]
+	pool_type = pool_type.lower()
+
+	if pool_type in possible_pools:
+		return pool_type
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded pool type is not a valid pool type!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided pool type is not a valid pool type!\n')
+# =============================================================================
+# Name:       parse_size(size_string)
+# Arguments:  size_string = a string with size in bytes, optional K, M or G suffix
+# Purpose:    Returns size in bytes or raises ValueError
+# =============================================================================
+def parse_size(size_string):
+	multipliers = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+	size_string = str(size_string).strip().upper()
+	multiplier = 1
+	if size_string[-1:] in multipliers:
+		multiplier = multipliers[size_string[-1]]
+		size_string = size_string[:-1]
+	return int(size_string) * multiplier
+# =============================================================================
+# Name:       validate_size_range(size_range)
+# Arguments:  size_range = a string "MIN:MAX", either side can be left empty
+# Purpose:    Returns (min_size, max_size) tuple, None for an open side
+# =============================================================================
+def validate_size_range(size_range):
+	try:
+		min_size, max_size = str(size_range).split(":")
+		min_size = parse_size(min_size) if min_size.strip() else None
+		max_size = parse_size(max_size) if max_size.strip() else None
+		return (min_size, max_size)
+	except ValueError:
+		raise InvalidSettingError('\n\n>>>>> Provided size range is not a valid MIN:MAX range!\n')
+# =============================================================================
+# Name:       validate_device_workers(device_workers)
+# Arguments:  device_workers = a string "PATH=N", PATH is any path on the device
+# Purpose:    Returns (path, workers) tuple or raises error
+# =============================================================================
+def validate_device_workers(device_workers):
+	device_path, separator, workers = str(device_workers).rpartition("=")
+	try:
+		workers = int(workers)
+	except ValueError:
+		workers = 0
+
+	if separator and os.path.exists(device_path) and workers >= 1:
+		return (device_path, workers)
+	else:
+		raise InvalidSettingError('\n\n>>>>> Provided device workers are not a valid PATH=N value!\n')
+# =============================================================================
+# Name:       validate_chunk_size(chunk_size, loaded)
+# Arguments:  chunk_size = a string with size in bytes, optional K or M suffix
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns chunk size in bytes (0 = adaptive) or raises error
+# =============================================================================
+def validate_chunk_size(chunk_size, loaded=False):
+	try:
+		chunk_size = parse_size(chunk_size)
+	except ValueError:
+		chunk_size = -1
+
+	if chunk_size >= 0:
+		return chunk_size
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded chunk size is not a valid size!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided chunk size is not a valid size!\n')
+# =============================================================================
+# Name:       validate_io_mode(io_mode, loaded)
+# Arguments:  io_mode = a string representing the file read engine
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns an io mode or raises error
+# =============================================================================
+def validate_io_mode(io_mode, loaded=False):
+	possible_modes = ["read", "mmap", "auto"]
+	io_mode = io_mode.lower()
+
+	if io_mode in possible_modes:
+		return io_mode
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded io mode is not a valid io mode!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided io mode is not a valid io mode!\n')
+# =============================================================================
+# Name:       validate_cache_mode(cache_mode, loaded)
+# Arguments:  cache_mode = a string representing hash cache mode
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns a cache mode or raises error
+# =============================================================================
+def validate_cache_mode(cache_mode, loaded=False):
+	possible_modes = ["off", "trust", "verify"]
+	cache_mode = cache_mode.lower()
+
+	if cache_mode in possible_modes:
+		return cache_mode
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded cache mode is not a valid cache mode!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided cache mode is not a valid cache mode!\n')
+# =============================================================================
+# Name:       validate_list_format(list_format, loaded)
+# Arguments:  list_format = a string representing format of session lists
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns a list format or raises error
+# =============================================================================
+def validate_list_format(list_format, loaded=False):
+	possible_formats = list(_list_extensions)
+	list_format = list_format.lower()
+
+	if list_format in possible_formats:
+		return list_format
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded list format is not a valid list format!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided list format is not a valid list format!\n')
+# =============================================================================
+# Name:       validate_filter_rule(rule, loaded)
+# Arguments:  rule = glob pattern, or regular expression after a "re:" prefix
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns the rule or raises error
+# =============================================================================
+def validate_filter_rule(rule, loaded=False):
+	try:
+		compile_filter_rule(rule)
+		return rule
+	except re.error:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded filter rule is not a valid glob or regular expression!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided filter rule is not a valid glob or regular expression!\n')
+# =============================================================================
+# Name:       validate_file_size(file_size, loaded)
+# Arguments:  file_size = a string with size in bytes, optional K, M or G suffix
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns file size in bytes or raises error
+# =============================================================================
+def validate_file_size(file_size, loaded=False):
+	try:
+		file_size = parse_size(file_size)
+	except ValueError:
+		file_size = -1
 
-	if hash_type in possible_hashes:
-		return hash_type
+	if file_size >= 0:
+		return file_size
 	else:
-		if(session_loaded == True):
-			print('\n>>>>> Loaded hash is not a valid or supported hash type!\n')
-			sys.exit(1)
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded file size is not a valid size!\n')
 		else:
-			raise argparse.ArgumentTypeError('\n\n>>>>> Provided hash is not a valid or supported hash type!\n')
+			raise InvalidSettingError('\n\n>>>>> Provided file size is not a valid size!\n')
 # =============================================================================
-# Argument Name:    target
-# Argument Type:    argument value
-# Functionality:    Receives target file or directory or recursive directory.
+# Name:       validate_max_depth(max_depth, loaded)
+# Arguments:  max_depth = a string representing directory levels below target
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns a depth of zero or more or raises error
 # =============================================================================
-#region ArgParse Arguments
-parser.add_argument("target", metavar='system_path', type=validate_target,
-help="""
+def validate_max_depth(max_depth, loaded=False):
+	try:
+		max_depth = int(max_depth)
+	except (TypeError, ValueError):
+		max_depth = -1
+
+	if max_depth >= 0:
+		return max_depth
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded max depth is not zero or a positive integer!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided max depth is not zero or a positive integer!\n')
+# =============================================================================
+# Name:       validate_follow_symlinks(follow_symlinks, loaded)
+# Arguments:  follow_symlinks = a string representing symlink follow policy
+#             loaded = True if value was loaded from a session config
+# Purpose:    Returns a follow policy or raises error
+# =============================================================================
+def validate_follow_symlinks(follow_symlinks, loaded=False):
+	possible_policies = ["never", "files", "all"]
+	follow_symlinks = follow_symlinks.lower()
+
+	if follow_symlinks in possible_policies:
+		return follow_symlinks
+	else:
+		if(loaded == True):
+			raise InvalidSettingError('\n>>>>> Loaded symlink policy is not a valid policy!\n')
+		else:
+			raise InvalidSettingError('\n\n>>>>> Provided symlink policy is not a valid policy!\n')
+# =============================================================================
+# Name:       build_parser()
+# Purpose:    Returns the argparse parser of the command line interface
+# =============================================================================
+def build_parser():
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+	# =============================================================================
+	# Argument Name:    target
+	# Argument Type:    argument value
+	# Functionality:    Receives target file or directory or recursive directory.
+	# =============================================================================
+	#region ArgParse Arguments
+	parser.add_argument("target", metavar='system_path', type=validate_target,
+	help="""
 ===============================================================================
 'HashPy.py file_path'           - Hashes only the single file specified
 'HashPy.py directory_path'      - Hashes files in specified directory
@@ -109,209 +410,406 @@ help="""
 'HashPy.py HashPy.config'       - Continues previous hashing session
 ===============================================================================           
 """)
-# =============================================================================
-# Argument Name:    -r
-# Argument Type:    flag
-# Functionality:    Toggles ON recursive mode for file discovery.
-# =============================================================================
-parser.add_argument("-r", "--recursive", action='store_true',
-help="""
+	# =============================================================================
+	# Argument Name:    -r
+	# Argument Type:    flag
+	# Functionality:    Toggles ON recursive mode for file discovery.
+	# =============================================================================
+	parser.add_argument("-r", "--recursive", action='store_true',
+	help="""
 ===============================================================================
 'HashPy.py directory -r'        - Hashes files in directory recursively
 ===============================================================================
 
 """)
-# =============================================================================
-# =============================================================================
-# Argument Name:    -v
-# Argument Type:    flag
-# Functionality:    Toggles ON verbose mode for output to console.
-# =============================================================================
-parser.add_argument("-v", "--verbose", action='store_true',
-help="""
+	# =============================================================================
+	# =============================================================================
+	# Argument Name:    -v
+	# Argument Type:    flag
+	# Functionality:    Toggles ON verbose mode for output to console.
+	# =============================================================================
+	parser.add_argument("-v", "--verbose", action='store_true',
+	help="""
 ===============================================================================
 Displays progress of the hashing process in console.
 'HashPy.py file_path -v'
 ===============================================================================
 
 """)
-# =========================================================================
-# Argument Name:    -hash_type 
-# Argument Type:    argument value
-# Functionality:    Receives hash_type
-# =========================================================================
-parser.add_argument("-hash","--hash_type", metavar='hash_type', type=validate_hash_type,
-help="""
-===============================================================================
-Hashing type used: MD5, SHA1, SHA224, SHA256, SHA384 or SHA512.
+	# =========================================================================
+	# Argument Name:    -hash_type 
+	# Argument Type:    argument value
+	# Functionality:    Receives hash_type
+	# =========================================================================
+	parser.add_argument("-hash","--hash_type", metavar='hash_type', type=validate_hash_type,
+	help="""
+===============================================================================
+Hashing type used: MD5, SHA1, SHA224, SHA256, SHA384, SHA512, BLAKE2B,
+BLAKE2S or BLAKE3 (if the blake3 package is installed). Several hash types
+separated with commas are calculated in a single read of each file.
 'HashPy.py file_path -hash hash_type'
+'HashPy.py file_path -hash MD5,SHA256'
 ===============================================================================
 
 """)
-#endregion
-
-# =============================================================================
-# Name:       update_settings(args)
-# Arguments:  args = argparse arguments after user input or loaded from config
-# Purpose:    Changes values to global variables based on user input
-# =============================================================================
-def update_settings(args):
-
-	global  session_target_path 
-	global  session_recursive_search
-	global  session_hash_type
-	global  session_verbose_mode
-	global  session_datetime
-	global  session_loaded_file
-	global  config_dir_path
-	global  config_file_path
-	global  discovered_list_path
-	global  hashed_list_path
-	# Handle checking session_loaded_file first
-	if (session_loaded == True):
-		# Handle checking session_loaded_file first
-		session_loaded_file = args.target
-		if (session_loaded_file is not None):
-			# Load settings from file
-			config = configparser.ConfigParser()
-			config.read(session_loaded_file)
-			settings = config['settings']
-			session_target_path = validate_target(settings['session_target_path'])
-			session_recursive_search = settings['session_recursive_search']
-			session_hash_type = validate_hash_type(settings['session_hash_type'])
-			session_verbose_mode = settings['session_verbose_mode']
-			session_datetime = settings['session_datetime']
-	else:
-		session_target_path = args.target
-		session_recursive_search = args.recursive
-		session_hash_type = args.hash_type if args.hash_type is not None else "MD5"
-		session_verbose_mode = args.verbose
-		session_loaded_file = config_file_path
-
-	config_dir_path = os.path.join(session_local_path,session_main_dir,session_datetime,session_config_dir)
-	# Path for config file
-	config_file_path = os.path.join(config_dir_path,session_config_file)
-	# Path for discovered_files fil
-	discovered_list_path = os.path.join(config_dir_path,session_discovered_list)
-	# Path for hashed files status file  ('hashed_files_status.txt')
-	hashed_list_path = os.path.join(config_dir_path,session_hashed_list)
-# =============================================================================
-# Name:       save_settings()
-# Purpose:    Saves current settings to session folder, ignores if loaded.
-# =============================================================================
-def save_settings():
-	if(session_loaded == False):
-		config = configparser.ConfigParser()
-		config['settings'] = {
-		'session_target_path': session_target_path,
-		'session_recursive_search': session_recursive_search,
-		'session_hash_type': session_hash_type,
-		'session_verbose_mode': session_verbose_mode,
-		'session_datetime': session_datetime
-		}
-		# Create folder for current session
-		os.makedirs(config_dir_path, exist_ok=True)
-		# Create/Open File in directory for new session
-		with open(config_file_path, 'w', encoding='utf8') as f:
-			config.write(f)
-# =============================================================================
-# Name:       print_settings
-# Purpose:    Prints current settings
-# =============================================================================
-def print_settings():
-	print ("{:<2}{:<25}".format('','======================================================================='))
-	print ("{:<2}{:<25}{:<10}".format('','Setting', 'Value'))
-	print ("{:<2}{:<25}".format('','======================================================================='))
-	print ("{:<2}{:<25}{:<10}".format('',"Session File", str(session_loaded_file)))
-	print ("{:<2}{:<25}{:<10}".format('',"Session Date&Time", str(session_datetime)))
-	print ("{:<2}{:<25}{:<10}".format('',"Session Loaded", str(session_loaded)))
-	print ("{:<2}{:<25}{:<10}".format('',"Target Path", str(session_target_path)))
-	print ("{:<2}{:<25}{:<10}".format('',"Recursive", str(session_recursive_search)))
-	print ("{:<2}{:<25}{:<10}".format('',"Hash Type", str(session_hash_type)))
-	print ("{:<2}{:<25}{:<10}".format('',"Verbose Progress", str(session_verbose_mode)))
-	print ("{:<2}{:<25}".format('','======================================================================='))
-# =============================================================================
-# =============================================================================
-# Name:       file_discovery_saving())
-# Purpose:    Saves list of discovered files to a file 'discovered_files.txt'
-# =============================================================================
-# TODO Might make a switch to determine if it's file discovery or hashed data
-def file_discovery_saving(discovered_file_data):
-	global _discovered_files_count
-	# Create folder for current session
-	os.makedirs(config_dir_path, exist_ok=True)
-	f = open(discovered_list_path, 'a', newline='', encoding='utf8') # newline='' removes blank lines between outputs that csv data tries to input?
-	with f:
-		writer = csv.writer(f)
-		writer.writerow(discovered_file_data)
-	_discovered_files_count += 1
-# =============================================================================
-# Name:       file_discovery_status(file_count)
-# Purpose:    Displays formatted console output showing number of files discovered.
-# =============================================================================
-def file_discovery_status(list_end):
-	if session_verbose_mode:
-		real__discovered_files_count = _discovered_files_count - 1 # correction for the header row
-		if (list_end):
-			print ("{:<2}{:<25}{:<10}".format('',"Discovered files", str(real__discovered_files_count)))
-			print ("{:<2}{:<25}".format('','======================================================================='))
-		else:
-			text = ("\r{:<2}{:<25}{:<10}".format('',"Discovered files", str(real__discovered_files_count)))
-			print (text,end='\r')
-# =============================================================================
-# Name:       file_discovery()
-# Purpose:    Discovers files and directories based on provided path.
-# =============================================================================
-def file_discovery():
-	#global discovered_files_data
-	# The general idea is to have a file discovery as before, but this time save all of the files and the information about them in csv format.
-	# Data that we are interested in mainly:
-	csv_format_header = ["Location", "Name", "Size","Created","Modified","Hash"]
-	file_discovery_saving(csv_format_header) # Save first Row
-	# File Discovery Functions Here:
-	# If path is a single file
-	if (os.path.isfile(session_target_path)):
-		current_file_info = get_file_info(session_target_path)
-
-		#discovered_files_data.append(current_file_info)
-		file_discovery_saving(current_file_info) 
-		file_discovery_status(False)
-	# If path is a directory
-	elif (os.path.isdir(session_target_path)):
-		for dir_path, directories, files in os.walk(session_target_path):
-			for file_name in files:
-				full_path = (os.path.join(dir_path, file_name))
-
-				current_file_info = get_file_info(full_path)
-				#discovered_files_data.append(current_file_info)
-				file_discovery_saving(current_file_info)
-				file_discovery_status(False)
-
-			# If it is not in recursive mode then it should stop now
-			if (session_recursive_search == False):
-				break
-			# Else it is recursive
-			else:
-				pass
+	# =========================================================================
+	# Argument Name:    -w
+	# Argument Type:    argument value
+	# Functionality:    Receives number of parallel hashing workers
+	# =========================================================================
+	parser.add_argument("-w","--workers", metavar='N', type=validate_workers,
+	help="""
+===============================================================================
+Number of files hashed in parallel (default 1). Results are still saved
+in discovery order.
+'HashPy.py directory_path -r -w 8'
+===============================================================================
 
-	file_discovery_status(True)
+""")
+	# =========================================================================
+	# Argument Name:    --pool
+	# Argument Type:    argument value
+	# Functionality:    Receives worker pool type used with --workers
+	# =========================================================================
+	parser.add_argument("--pool", metavar='pool_type', type=validate_pool_type,
+	help="""
+===============================================================================
+Worker pool used with --workers: thread (default) or process.
+'HashPy.py directory_path -r -w 8 --pool process'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --device-workers
+	# Argument Type:    argument value, can be repeated
+	# Functionality:    Receives number of hashing workers of a device
+	# =========================================================================
+	parser.add_argument("--device-workers", metavar='PATH=N', type=validate_device_workers, action='append',
+	help="""
+===============================================================================
+Files are hashed by a worker pool per device (st_dev) of their directory,
+every device runs -w workers unless set here for the device holding PATH.
+A device runs out of work only when the other devices are far behind, e.g.
+one worker for a spinning disk and eight for a network share:
+'HashPy.py / -r -w 4 --device-workers /mnt/hdd=1 --device-workers /mnt/nfs=8'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --discovery-workers
+	# Argument Type:    argument value
+	# Functionality:    Receives number of directories scanned in parallel
+	# =========================================================================
+	parser.add_argument("--discovery-workers", metavar='N', type=validate_workers,
+	help="""
+===============================================================================
+Number of directories scanned in parallel during file discovery (default 1).
+Useful on network shares where each directory listing waits on the server.
+'HashPy.py directory_path -r --discovery-workers 16'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --stream
+	# Argument Type:    flag
+	# Functionality:    Toggles ON hashing while file discovery is running
+	# =========================================================================
+	parser.add_argument("--stream", action='store_true',
+	help="""
+===============================================================================
+Starts hashing files as soon as they are discovered instead of waiting for
+discovery to finish. The session is saved when it starts, a session stopped
+during discovery discovers the remaining files when resumed.
+'HashPy.py directory_path -r --stream'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --metrics-file
+	# Argument Type:    argument value
+	# Functionality:    Receives path of file for metrics snapshots
+	# =========================================================================
+	parser.add_argument("--metrics-file", metavar='file_path',
+	help="""
+===============================================================================
+Appends a JSON line with counters and timers (files, bytes, stat, read,
+hash, mapped file and write time, throughput and ETA) every second and at the
+end of every phase. bound tells if reads (io) or hashing (cpu) took longer,
+it is null once a file was mapped as page faults can't be timed.
+'HashPy.py directory_path -r --metrics-file metrics.jsonl'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --dedupe
+	# Argument Type:    flag
+	# Functionality:    Finds duplicate files instead of hashing every file
+	# =========================================================================
+	parser.add_argument("--dedupe", action='store_true',
+	help="""
+===============================================================================
+Finds duplicate files in the discovered list and saves the groups to
+results/duplicates.csv. Only files sharing a size are read, first their
+head and tail, then fully for files that still match. Hardlinks are
+recognised and never read twice.
+'HashPy.py directory_path -r --dedupe'
+'HashPy.py HashPy.config --dedupe'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --verify / --paranoid
+	# Argument Type:    flag
+	# Functionality:    Compares the target of a loaded session with its results
+	# =========================================================================
+	parser.add_argument("--verify", action='store_true',
+	help="""
+===============================================================================
+Uses the loaded session as a baseline and reports files that were added,
+removed, modified or moved (same hash, new path) since. Only files with a
+different size or modification time are hashed again.
+'HashPy.py HashPy.config --verify'
+===============================================================================
+
+""")
+	parser.add_argument("--paranoid", action='store_true',
+	help="""
+===============================================================================
+With --verify, hashes every file again even if size and modification
+time didn't change.
+'HashPy.py HashPy.config --verify --paranoid'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --bench
+	# Argument Type:    flag
+	# Functionality:    Runs benchmarks on synthetic files in target directory
+	# =========================================================================
+	parser.add_argument("--bench", action='store_true',
+	help="""
+===============================================================================
+Generates synthetic trees (many tiny files, a few huge files and deep
+nesting) in a temporary directory inside the target, times file discovery,
+hashing per hash type and chunk size and the csv writer, and saves the
+results to results/bench_<date>.json.
+'HashPy.py directory_path --bench'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --query-path / --query-hash / --query-size
+	# Argument Type:    argument value
+	# Functionality:    Looks up files in a loaded session through its index
+	# =========================================================================
+	parser.add_argument("--query-path", metavar='file_path',
+	help="""
+===============================================================================
+Prints the saved row of a file in the loaded session as csv.
+'HashPy.py HashPy.config --query-path /data/file.bin'
+===============================================================================
+
+""")
+	parser.add_argument("--query-hash", metavar='hash',
+	help="""
+===============================================================================
+Prints all files in the loaded session with the given hash as csv.
+'HashPy.py HashPy.config --query-hash d41d8cd98f00b204e9800998ecf8427e'
+===============================================================================
+
+""")
+	parser.add_argument("--query-size", metavar='MIN:MAX', type=validate_size_range,
+	help="""
+===============================================================================
+Prints all files in the loaded session within the size range as csv, K, M
+and G suffixes allowed and either side can be left empty.
+'HashPy.py HashPy.config --query-size 1G:'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --chunk-size
+	# Argument Type:    argument value
+	# Functionality:    Receives read chunk size used when hashing
+	# =========================================================================
+	parser.add_argument("--chunk-size", metavar='bytes', type=validate_chunk_size,
+	help="""
+===============================================================================
+Read chunk size in bytes, K and M suffixes allowed. Default 0 picks the
+chunk size from the file size (64K, 1M or 4M).
+'HashPy.py directory_path -r --chunk-size 1M'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --io-mode
+	# Argument Type:    argument value
+	# Functionality:    Receives file read engine used when hashing
+	# =========================================================================
+	parser.add_argument("--io-mode", metavar='io_mode', type=validate_io_mode,
+	help="""
+===============================================================================
+File read engine: read, mmap or auto (default). read and auto read files
+into a reused buffer. mmap maps every file instead, which is unsafe on files
+that change while being hashed: a file truncated by another process kills
+HashPy with a bus error, losing the rows not yet saved.
+'HashPy.py directory_path -r --io-mode mmap'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --trust-cache / --verify-cache
+	# Argument Type:    flag
+	# Functionality:    Toggles ON the hash cache shared between sessions
+	# =========================================================================
+	cache_group = parser.add_mutually_exclusive_group()
+	cache_group.add_argument("--trust-cache", dest='cache_mode', action='store_const', const='trust',
+	help="""
+===============================================================================
+Reuses cached hashes for files with unchanged path, inode, size and
+modification time without reading them. New hashes are added to the cache
+in Sessions/hash_cache.sqlite.
+'HashPy.py directory_path -r --trust-cache'
+===============================================================================
+
+""")
+	cache_group.add_argument("--verify-cache", dest='cache_mode', action='store_const', const='verify',
+	help="""
+===============================================================================
+Hashes every file and reports cached hashes that no longer match the data
+of an unchanged file. New hashes are added to the cache.
+'HashPy.py directory_path -r --verify-cache'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --format
+	# Argument Type:    argument value
+	# Functionality:    Receives format of the discovered and hashed lists
+	# =========================================================================
+	parser.add_argument("--format", metavar='list_format', type=validate_list_format,
+	help="""
+===============================================================================
+Format of the discovered and hashed files lists: csv (default) or binary.
+Binary lists (.hpb) keep each directory once per list, hashes as raw bytes
+and sizes and times as integers, which makes them about 2.3 times smaller
+than csv lists. Resume and --dedupe read only the columns they need from
+binary lists, whole rows are read about as fast as from csv lists.
+'HashPy.py directory_path -r --format binary'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --convert
+	# Argument Type:    argument value
+	# Functionality:    Converts a session list between csv and binary format
+	# =========================================================================
+	parser.add_argument("--convert", metavar='list_path',
+	help="""
+===============================================================================
+Converts the session list given as target to list_path, the format is
+picked from the extension (.csv or .hpb).
+'HashPy.py hashed_files.hpb --convert hashed_files.csv'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --include / --exclude
+	# Argument Type:    argument value, can be repeated
+	# Functionality:    Receives filter rules applied during file discovery
+	# =========================================================================
+	parser.add_argument("--include", metavar='rule', type=validate_filter_rule, action='append',
+	help="""
+===============================================================================
+Only files matching one of the include rules are discovered. Rules are
+globs, or regular expressions after a "re:" prefix. Globs without "/" match
+file names, globs with "/" and regular expressions match the path relative
+to the target.
+'HashPy.py directory_path -r --include "*.jpg" --include "*.png"'
+===============================================================================
+
+""")
+	parser.add_argument("--exclude", metavar='rule', type=validate_filter_rule, action='append',
+	help="""
+===============================================================================
+Files and directories matching one of the exclude rules are skipped, same
+rules as --include. Excluded directories are never scanned.
+'HashPy.py directory_path -r --exclude node_modules --exclude .git'
+'HashPy.py directory_path -r --exclude "re:^backup/\\d{4}"'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --min-size / --max-size
+	# Argument Type:    argument value
+	# Functionality:    Receives size limits of discovered files
+	# =========================================================================
+	parser.add_argument("--min-size", metavar='bytes', type=validate_file_size,
+	help="""
+===============================================================================
+Skips files smaller than the size, K, M and G suffixes allowed.
+'HashPy.py directory_path -r --min-size 1M'
+===============================================================================
+
+""")
+	parser.add_argument("--max-size", metavar='bytes', type=validate_file_size,
+	help="""
+===============================================================================
+Skips files larger than the size, K, M and G suffixes allowed.
+'HashPy.py directory_path -r --max-size 4G'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --one-file-system
+	# Argument Type:    flag
+	# Functionality:    Toggles ON staying on the filesystem of the target
+	# =========================================================================
+	parser.add_argument("--one-file-system", action='store_true',
+	help="""
+===============================================================================
+Doesn't scan directories on other filesystems than the target, e.g. /proc,
+network shares or other disks mounted below the target.
+'HashPy.py / -r --one-file-system'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --max-depth
+	# Argument Type:    argument value
+	# Functionality:    Receives directory levels scanned below the target
+	# =========================================================================
+	parser.add_argument("--max-depth", metavar='N', type=validate_max_depth,
+	help="""
+===============================================================================
+Scans at most N directory levels below the target in recursive mode, 0
+scans only the target directory.
+'HashPy.py directory_path -r --max-depth 2'
+===============================================================================
+
+""")
+	# =========================================================================
+	# Argument Name:    --follow-symlinks
+	# Argument Type:    argument value
+	# Functionality:    Receives which symlinks are followed during discovery
+	# =========================================================================
+	parser.add_argument("--follow-symlinks", metavar='policy', type=validate_follow_symlinks,
+	help="""
+===============================================================================
+never: symlinks are skipped. files (default): symlinks to files are hashed,
+symlinks to directories are skipped. all: symlinks to directories are
+scanned too, directories reached a second time (link loops) are skipped.
+FIFOs, devices and sockets are never hashed. A file reached through several
+hardlinks or symlinks is read once and its hash is saved for every path.
+'HashPy.py directory_path -r --follow-symlinks all'
+===============================================================================
+
+""")
+	#endregion
+	return parser
 # =============================================================================
-# Name:       get_file_info(file_path)
-# Purpose:    Returns metadata about file
+# Section: Display Functions
 # =============================================================================
-def get_file_info(file_path):
-
-	# If path is a valid file
-	if (os.path.isfile(file_path)):
-		# 10 digit tuple with following data: (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime)
-		st = os.stat(file_path)
-		file_path, file_name = os.path.split(file_path)
-		# Format:           ["Location", "Name", "Size","Created","Modified","Hash"]
-		current_file_info = [file_path, file_name, st[6],st[9],st[8],None]
-		return current_file_info
-	else:
-		#Perhaps some error code here with path for when it happened.
-		pass
 # =============================================================================
 # Name:       correct_file_size(num)
 # Purpose:    Return corrected value for file size.
@@ -323,48 +821,9 @@ def correct_file_size(num):
     		return "%3.1f %s" % (num, x)
     	num /= 1024.0
 # =============================================================================
-# Name:       get_hashing_status(file_path, list_end)
-# Purpose:    Displays formatted console output showing number of files discovered.
-# =============================================================================
-def display_hashing_status(hashing_file_data, list_end):
-	global _last_output_length
-
-	file_name = hashing_file_data[1]
-	file_size = correct_file_size(int(hashing_file_data[2]))
-	# Shortens the name to 40 characters
-	file_name = file_name[:40]
-
-	if(list_end):
-		print("{:<2}{:<8}{:<5}{:<1}{:<8}{:<6}{:<10}{:<6}{:<10}".format('',"Hashing",_hashed_files_count,"/",_discovered_files_count-1, "Size:", file_size,"Name: ",str(file_name)))
-		print("{:<2}{:<25}".format('','======================================================================='))
-	else:
-		# Add +1 if this doesn't work correctly
-		text = ("\r{:<2}{:<8}{:<5}{:<1}{:<8}{:<6}{:<10}{:<6}{:<10}".format('',"Hashing",_hashed_files_count,"/",_discovered_files_count-1, "Size:", file_size,"Name: ",str(file_name)))
-		# If previous entry was longer, clear the entry
-		if (_last_output_length > len(text)):
-			print(" "*_last_output_length,end='\r')
-		# Display current entry
-		print (text,end='\r')
-		# Update last entry length
-		_last_output_length = len(text)
-# =============================================================================
-# Name:       file_hashed_saving()
-# Purpose:    Saves list of hashed files to a file 'hashed_files.csv'
-# =============================================================================
-def file_hashed_saving(hashed_file_data):
-	global _hashed_files_count
-	# Create folder for current session
-	os.makedirs(config_dir_path, exist_ok=True)
-	f = open(hashed_list_path, 'a', newline='', encoding='utf8') # newline='' removes blank lines between outputs that csv data tries to input?
-	with f:
-		writer = csv.writer(f)
-		#writer.writerows(discovered_file_data)
-		writer.writerow(hashed_file_data)
-	_hashed_files_count += 1
-# =============================================================================
 # Name:       convert_bytes(num)
 # Purpose:    Returns placeholder length for hash
-# =============================================================================	
+# =============================================================================
 def convert_bytes(num):
 	# Converts number to correct size string
 	for x in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -372,124 +831,3115 @@ def convert_bytes(num):
 			return "%3.1f %s" % (num, x)
 		num /= 1024.0
 # =============================================================================
+# Section: File Discovery Functions
+# =============================================================================
+# =============================================================================
+# Name:       get_link_target(dir_path, link_path)
+# Arguments:  dir_path = directory holding the symlink, as it is discovered
+#             link_path = path of the symlink
+# Purpose:    Returns the path a symlink points to, written the way discovery
+#             writes paths (relative when dir_path is), so it matches the row
+#             of the target when the target is discovered too.
+# =============================================================================
+def get_link_target(dir_path, link_path):
+	target_path = os.path.join(dir_path, os.readlink(link_path))
+	if os.path.isabs(target_path) and not os.path.isabs(dir_path):
+		target_path = os.path.relpath(target_path)
+	return os.path.normpath(target_path)
+# =============================================================================
+# Name:       scan_directory(dir_path, discovery_filter, depth, follow_symlinks)
+# Arguments:  dir_path = directory to scan
+#             discovery_filter = optional DiscoveryFilter
+#             depth = directory levels of dir_path below the target
+#             follow_symlinks = symlink policy: never, files or all
+# Purpose:    Returns (file info list, list of (sub directory, directory key),
+#             seconds spent in stat calls, Counter of skipped entry types,
+#             list of (file path, inode key) of files with several links,
+#             followed symlinks and the paths these symlinks point to).
+#             Uses os.scandir so file type comes from the directory listing
+#             and each file needs a single stat call. Unreadable entries are
+#             skipped and filtered directories and names are dropped before
+#             any stat call. Directory key is (device, inode) when directory
+#             links are followed, so the caller can detect link loops.
+# =============================================================================
+def scan_directory(dir_path, discovery_filter=None, depth=0, follow_symlinks="files"):
+	directory_files = []
+	sub_dirs = []
+	stat_seconds = 0.0
+	entry_counts = collections.Counter()
+	file_links = []
+	try:
+		with os.scandir(dir_path) as entries:
+			for entry in entries:
+				try:
+					entry_type = get_entry_type(entry, follow_symlinks)
+					if entry_type == "directory":
+						if discovery_filter is None or discovery_filter.allow_directory(entry, depth + 1):
+							dir_key = None
+							if follow_symlinks == "all":
+								st = entry.stat()
+								dir_key = (st.st_dev, st.st_ino)
+							sub_dirs.append((entry.path, dir_key))
+					elif entry_type == "file":
+						if discovery_filter is not None and not discovery_filter.allow_file(entry):
+							continue
+						stat_start = perf_counter()
+						current_file_info = get_entry_info(dir_path, entry)
+						stat_seconds += perf_counter() - stat_start
+						if discovery_filter is None or discovery_filter.allow_size(current_file_info[2]):
+							directory_files.append(current_file_info)
+							# Hardlinks and followed symlinks can reach an inode more than once
+							st = entry.stat()
+							if st.st_ino and (st.st_nlink > 1 or entry.is_symlink()):
+								file_links.append((entry.path, (st.st_dev, st.st_ino)))
+							if st.st_ino and entry.is_symlink():
+								# Target has a single link of its own, so it is recorded here
+								file_links.append((get_link_target(dir_path, entry.path), (st.st_dev, st.st_ino)))
+							if st.st_nlink > 1:
+								entry_counts["hardlink"] += 1
+					else:
+						entry_counts[entry_type] += 1
+				except OSError:
+					pass # Entry removed or not accessible since listing
+	except OSError:
+		pass # Directory not accessible, same as os.walk
+	return directory_files, sub_dirs, stat_seconds, entry_counts, file_links
+# =============================================================================
+# Name:       get_mode_type(mode)
+# Arguments:  mode = st_mode of a stat result
+# Purpose:    Returns file type: file, directory, fifo, device, socket or other
+# =============================================================================
+def get_mode_type(mode):
+	if stat.S_ISREG(mode):
+		return "file"
+	elif stat.S_ISDIR(mode):
+		return "directory"
+	elif stat.S_ISFIFO(mode):
+		return "fifo"
+	elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+		return "device"
+	elif stat.S_ISSOCK(mode):
+		return "socket"
+	return "other"
+# =============================================================================
+# Name:       get_entry_type(entry, follow_symlinks)
+# Arguments:  entry = os.DirEntry from os.scandir
+#             follow_symlinks = symlink policy: never, files or all
+# Purpose:    Returns type of the entry as get_mode_type(), followed symlinks
+#             get the type of their target. Symlinks that aren't followed or
+#             are broken are "symlink". Regular files and directories are
+#             known from the directory listing without a stat call.
+# =============================================================================
+def get_entry_type(entry, follow_symlinks="files"):
+	if entry.is_symlink():
+		if follow_symlinks == "never":
+			return "symlink"
+		try:
+			mode = entry.stat().st_mode
+		except OSError:
+			return "symlink" # Broken link or link to itself
+		if stat.S_ISDIR(mode) and follow_symlinks != "all":
+			return "symlink"
+		return get_mode_type(mode)
+	if entry.is_dir(follow_symlinks=False):
+		return "directory"
+	if entry.is_file(follow_symlinks=False):
+		return "file"
+	return get_mode_type(entry.stat(follow_symlinks=False).st_mode)
+# =============================================================================
+# Name:       get_entry_info(dir_path, entry)
+# Arguments:  dir_path = directory that was scanned
+#             entry = os.DirEntry of a file from os.scandir
+# Purpose:    Returns metadata about file, same format as get_file_info()
+# =============================================================================
+def get_entry_info(dir_path, entry):
+	# Stat result is cached on the entry (and already known on Windows)
+	st = entry.stat()
+	# Format:           ["Location", "Name", "Size","Created","Modified","Hash"] + [Inode]
+	return [dir_path, entry.name, st[6],st[9],st[8],None,st[1]]
+# =============================================================================
+# Name:       get_file_info(file_path)
+# Purpose:    Returns metadata about file, or None if the path (after following
+#             symlinks) is missing or not a regular file. Inode comes after the
+#             saved columns, it is only used to order reads while streaming.
+# =============================================================================
+def get_file_info(file_path):
+	try:
+		# 10 digit tuple with following data: (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime)
+		st = os.stat(file_path)
+	except OSError:
+		return None
+	# FIFOs, devices and sockets are never hashed
+	if not stat.S_ISREG(st.st_mode):
+		return None
+	file_path, file_name = os.path.split(file_path)
+	# Format:           ["Location", "Name", "Size","Created","Modified","Hash"] + [Inode]
+	current_file_info = [file_path, file_name, st[6],st[9],st[8],None,st[1]]
+	return current_file_info
+# =============================================================================
+# Name:       compile_filter_rule(rule)
+# Arguments:  rule = glob pattern, or regular expression after a "re:" prefix
+# Purpose:    Returns (match function, True if the rule matches the path
+#             relative to the target or False if it matches the name only).
+#             Globs without "/" match names e.g. "*.tmp" or "node_modules",
+#             globs with "/" match relative paths e.g. "photos/*/thumbs".
+#             Regular expressions are searched in the relative path.
+# =============================================================================
+def compile_filter_rule(rule):
+	if rule.startswith("re:"):
+		return re.compile(rule[3:]).search, True
+	return re.compile(fnmatch.translate(rule)).match, "/" in rule
+# =============================================================================
+# Name:       DiscoveryFilter(root_path, include, exclude, min_size, max_size,
+#             one_file_system, max_depth)
+# Arguments:  root_path = directory where file discovery starts
+#             include, exclude = lists of filter rules
+#             min_size, max_size = file size limits in bytes or None
+#             one_file_system = skip directories on other devices than root
+#             max_depth = directory levels scanned below root or None
+# Purpose:    Decides which entries scan_directory() keeps. Directories are
+#             pruned by exclude rules, depth and device, so nothing below them
+#             is listed. Include rules only apply to files.
+# =============================================================================
+class DiscoveryFilter:
+
+	def __init__(self, root_path, include=(), exclude=(), min_size=None, max_size=None, one_file_system=False, max_depth=None):
+		self.root_prefix = os.path.join(root_path, "")
+		self.include_rules = [compile_filter_rule(rule) for rule in include]
+		self.exclude_rules = [compile_filter_rule(rule) for rule in exclude]
+		self.min_size = min_size
+		self.max_size = max_size
+		self.max_depth = max_depth
+		self.root_device = os.stat(root_path).st_dev if one_file_system else None
+	# =========================================================================
+	# Name:       matches(rules, entry)
+	# Arguments:  rules = compiled filter rules
+	#             entry = os.DirEntry from os.scandir
+	# Purpose:    Returns True if any rule matches the entry
+	# =========================================================================
+	def matches(self, rules, entry):
+		relative_path = None
+		for match, match_path in rules:
+			if not match_path:
+				if match(entry.name):
+					return True
+				continue
+			if relative_path is None:
+				relative_path = entry.path
+				if relative_path.startswith(self.root_prefix):
+					relative_path = relative_path[len(self.root_prefix):]
+				relative_path = relative_path.replace(os.sep, "/")
+			if match(relative_path):
+				return True
+		return False
+	# =========================================================================
+	# Name:       allow_directory(entry, depth)
+	# Arguments:  entry = os.DirEntry of a directory
+	#             depth = directory levels of the entry below root
+	# Purpose:    Returns True if the directory should be scanned
+	# =========================================================================
+	def allow_directory(self, entry, depth):
+		if self.max_depth is not None and depth > self.max_depth:
+			return False
+		if self.exclude_rules and self.matches(self.exclude_rules, entry):
+			return False
+		# Only stat directories when staying on one filesystem
+		if self.root_device is not None and entry.stat().st_dev != self.root_device:
+			return False
+		return True
+	# =========================================================================
+	# Name:       allow_file(entry)
+	# Arguments:  entry = os.DirEntry of a file
+	# Purpose:    Returns True if the file passes include and exclude rules
+	# =========================================================================
+	def allow_file(self, entry):
+		if self.exclude_rules and self.matches(self.exclude_rules, entry):
+			return False
+		if self.include_rules and not self.matches(self.include_rules, entry):
+			return False
+		return True
+	# =========================================================================
+	# Name:       allow_size(file_size)
+	# Arguments:  file_size = size of the file in bytes
+	# Purpose:    Returns True if the file size is within min and max size
+	# =========================================================================
+	def allow_size(self, file_size):
+		if self.min_size is not None and file_size < self.min_size:
+			return False
+		if self.max_size is not None and file_size > self.max_size:
+			return False
+		return True
+# =============================================================================
+# Section: Hashing Functions
+# =============================================================================
+# =============================================================================
+# Name:       get_hash_types(hash_type)
+# Arguments:  hash_type = validated hash type string
+# Purpose:    Returns list of hash types e.g. "MD5,SHA256" -> ["MD5", "SHA256"]
+# =============================================================================
+def get_hash_types(hash_type):
+	return hash_type.split(",")
+# =============================================================================
+# Name:       get_hash_columns(hash_type)
+# Arguments:  hash_type = validated hash type string
+# Purpose:    Returns csv hash column names. First hash type is always saved in
+#             "Hash", any other hash types get their own "Hash_<type>" column.
+# =============================================================================
+def get_hash_columns(hash_type):
+	hash_types = get_hash_types(hash_type)
+	return ["Hash"] + ["Hash_" + single_type for single_type in hash_types[1:]]
+# =============================================================================
 # Name:       get_hash_object(hash_type)
 # Arguments:  hash_type = a string that corresponds to the type of hash being used
 # Purpose:    Returns a hash object or none
 # Source:     https://docs.python.org/2/library/hashlib.html
 # =============================================================================
 def get_hash_object(hash_type):
-
-	if hash_type == "MD5":
-		return hashlib.md5()
-	elif hash_type == "SHA1":
-		return hashlib.sha1()
-	elif hash_type == "SHA224":
-		return hashlib.sha224()
-	elif hash_type == "SHA256":
-		return hashlib.sha256()
-	elif hash_type == "SHA384":
-		return hashlib.sha384()
-	elif hash_type == "SHA512":
-		return hashlib.sha512()
-	else:
-		return hashlib.md5()
-		# default md5
+	# default md5
+	return _hash_constructors.get(hash_type, hashlib.md5)()
 # =============================================================================
-# Name:       get_dummy_hash_value()
+# Name:       get_dummy_hash_value(hash_type)
+# Arguments:  hash_type = hash type of the placeholder
 # Purpose:    Returns placeholder length for hash
-# =============================================================================	
-def get_dummy_hash_value():
-	if session_hash_type == "MD5":
-		return "-" * 32
-	elif session_hash_type == "SHA1":
-		return "-" * 40
-	elif session_hash_type == "SHA224":
-		return "-" * 56
-	elif session_hash_type == "SHA256":
-		return "-" * 64
-	elif session_hash_type == "SHA384":
-		return "-" * 96
-	elif session_hash_type == "SHA512":
-		return "-" * 128
-# =============================================================================
-# Name:       hash_file(filename)
+# =============================================================================
+def get_dummy_hash_value(hash_type):
+	# Two hex characters per digest byte
+	return "-" * (get_hash_object(hash_type).digest_size * 2)
+# =============================================================================
+# Name:       get_chunk_size(file_size, chunk_size)
+# Arguments:  file_size = size of the file in bytes
+#             chunk_size = requested chunk size, 0 picks it from file size
+# Purpose:    Returns read chunk size for a file
+# =============================================================================
+def get_chunk_size(file_size, chunk_size=0):
+	if chunk_size > 0:
+		return chunk_size
+	elif file_size <= _small_file_limit:
+		return _small_chunk_size
+	elif file_size <= _medium_file_limit:
+		return _medium_chunk_size
+	else:
+		return _large_chunk_size
+# =============================================================================
+# Name:       get_read_buffer(chunk_size)
+# Arguments:  chunk_size = size of the buffer in bytes
+# Purpose:    Returns a preallocated buffer reused by the current thread
+# =============================================================================
+def get_read_buffer(chunk_size):
+	buffers = getattr(_read_buffers, 'buffers', None)
+	if buffers is None:
+		buffers = _read_buffers.buffers = {}
+	if chunk_size not in buffers:
+		buffers[chunk_size] = bytearray(chunk_size)
+	return buffers[chunk_size]
+# =============================================================================
+# Name:       advise_sequential(fd)
+# Arguments:  fd = file descriptor of an open file
+# Purpose:    Hints the kernel that the file will be read sequentially
+# =============================================================================
+def advise_sequential(fd):
+	if hasattr(os, 'posix_fadvise'):
+		try:
+			os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+		except OSError:
+			pass # Not supported by this filesystem
+# =============================================================================
+# =============================================================================
+# Name:       open_regular_file(file_path)
+# Arguments:  file_path = full path of the file
+# Purpose:    Returns (unbuffered binary file, stat result). The file is opened
+#             without blocking and raises OSError if the path isn't a regular
+#             file anymore, so a FIFO or device put in place of a discovered
+#             file can't block or never end the hashing.
+# =============================================================================
+def open_regular_file(file_path):
+	fd = os.open(file_path, _read_open_flags)
+	try:
+		st = os.fstat(fd)
+		if not stat.S_ISREG(st.st_mode):
+			raise OSError("Not a regular file: {}".format(file_path))
+	except BaseException:
+		os.close(fd)
+		raise
+	return open(fd, 'rb', buffering=0), st
+# =============================================================================
+# Name:       hash_file_digests(filename, hash_types, chunk_size, io_mode, timings)
+# Arguments:  filename = a string that corresponds to the file that is being hashed
+#             hash_types = list of hash types calculated in the same read
+#             chunk_size = read chunk size in bytes, 0 picks it from file size
+#             io_mode = read, mmap or auto
+#             timings = optional dict, read_seconds and hash_seconds are
+#             added to it. Mapped files are read by page faults while
+#             hashing, so their time is added to mapped_seconds instead.
+# Purpose:    Returns list of hash digests from the file, one per hash type
+# =============================================================================
+def hash_file_digests(filename, hash_types, chunk_size=0, io_mode="auto", timings=None):
+	# make a hash object per hash type
+	hashes = [get_hash_object(hash_type) for hash_type in hash_types]
+	read_seconds = hash_seconds = mapped_seconds = 0.0
+	# open file for reading in binary mode, unbuffered as reads go into our buffer
+	f, st = open_regular_file(filename)
+	try:
+		file_size = st.st_size
+		advise_sequential(f.fileno())
+		step = get_chunk_size(file_size, chunk_size)
+
+		# Only mapped on request, a mapped file truncated while hashing kills
+		# the interpreter with SIGBUS
+		if io_mode == "mmap" and file_size > 0:
+			hash_start = perf_counter()
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+				if hasattr(mapped_file, 'madvise'):
+					mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+				if len(hashes) == 1:
+					hashes[0].update(mapped_file)
+				else:
+					# Feed every hash the same chunk while it is still in cache
+					with memoryview(mapped_file) as view:
+						for offset in range(0, file_size, step):
+							with view[offset:offset + step] as chunk:
+								for h in hashes:
+									h.update(chunk)
+			mapped_seconds = perf_counter() - hash_start
+		else:
+			buffer = get_read_buffer(step)
+			view = memoryview(buffer)
+			# loop till the end of the file, reading into the same buffer
+			while True:
+				read_start = perf_counter()
+				read_size = f.readinto(buffer)
+				hash_start = perf_counter()
+				read_seconds += hash_start - read_start
+				if not read_size:
+					break
+				chunk = view if read_size == len(buffer) else view[:read_size]
+				for h in hashes:
+					h.update(chunk)
+				hash_seconds += perf_counter() - hash_start
+	finally:
+		f.close()
+		if timings is not None:
+			timings["read_seconds"] = timings.get("read_seconds", 0.0) + read_seconds
+			timings["hash_seconds"] = timings.get("hash_seconds", 0.0) + hash_seconds
+			if mapped_seconds:
+				timings["mapped_seconds"] = timings.get("mapped_seconds", 0.0) + mapped_seconds
+	# return the hex representation of digests
+	return [h.hexdigest() for h in hashes]
+# =============================================================================
+# Name:       hash_file(filename, hash_type, chunk_size, io_mode)
 # Arguments:  filename = a string that corresponds to the file that is being hashed
+#             hash_type = hash type to be used
+#             chunk_size = read chunk size in bytes, 0 picks it from file size
+#             io_mode = read, mmap or auto
 # Source:     http://www.programiz.com/python-programming/examples/hash-file
-# Purpose:    Returns a hash digest from the file
+# Purpose:    Returns a hash digest from the file, or list of digests when
+#             hash_type names several hash types e.g. "MD5,SHA256"
 # Notes:      Removed Try catch from it as per recommendation on
 # Source:     https://stackoverflow.com/questions/35953283/how-do-i-have-a-python-function-return-an-exception-traceback-or-the-result
 # =============================================================================
-def hash_file(filename):
-	# make a hash object
-	h = get_hash_object(session_hash_type)
-	# open file for reading in binary mode
-	f = open(filename, 'rb')
-	# TODO do some benchmarking for chunk size based on file size?
+def hash_file(filename, hash_type="MD5", chunk_size=0, io_mode="auto"):
+	hash_types = get_hash_types(hash_type)
+	digests = hash_file_digests(filename, hash_types, chunk_size, io_mode)
+	if len(digests) == 1:
+		return digests[0]
+	return digests
+# =============================================================================
+# Name:       hash_file_safe(file_path, hash_type, chunk_size, io_mode, timings)
+# Arguments:  file_path = full path of the file that is being hashed
+#             hash_type, chunk_size, io_mode, timings = passed on to hash_file_digests()
+# Purpose:    Returns list of hash digests or dummy hash values if file can't
+#             be hashed.
+# =============================================================================
+def hash_file_safe(file_path, hash_type, chunk_size=0, io_mode="auto", timings=None):
+	hash_types = get_hash_types(hash_type)
+	try:
+		return hash_file_digests(file_path, hash_types, chunk_size, io_mode, timings)
+	except Exception:
+		# Returns Dummy Hash Value '-------' to keep structure
+		return [get_dummy_hash_value(single_type) for single_type in hash_types]
+# =============================================================================
+# Name:       hash_file_timed(file_path, hash_type, chunk_size, io_mode)
+# Arguments:  file_path, hash_type, chunk_size, io_mode = passed on to hash_file_safe()
+# Purpose:    Returns (list of hash digests, timings dict). Module level so it
+#             can be sent to a process pool, timings travel back with result.
+# =============================================================================
+def hash_file_timed(file_path, hash_type, chunk_size=0, io_mode="auto"):
+	timings = {}
+	file_hashes = hash_file_safe(file_path, hash_type, chunk_size, io_mode, timings)
+	return file_hashes, timings
+# =============================================================================
+# Name:       hash_small_file(file_path, file_size, hash_types, timings)
+# Arguments:  file_path = full path of the file
+#             file_size = size of the file from the discovered list
+#             hash_types = list of hash types to be used
+#             timings = optional dict, read and hash seconds are added to it
+# Purpose:    Returns list of hash digests of a small file. The whole file is
+#             read with a single call, one byte more than the recorded size
+#             so the read at the end of the file is not needed. Files that
+#             changed size since discovery are read to the end in chunks,
+#             each hashed as it is read.
+# =============================================================================
+def hash_small_file(file_path, file_size, hash_types, timings=None):
+	hashes = [get_hash_object(hash_type) for hash_type in hash_types]
+	read_seconds = hash_seconds = 0.0
+	read_start = perf_counter()
+	fd = os.open(file_path, _read_open_flags)
 	try:
-		# loop till the end of the file
-		chunk = 0
-		while chunk != b'':
-			# read only 1024 bytes at a time
-			chunk = f.read(1024)
-			h.update(chunk)
+		chunk = os.read(fd, file_size + 1)
+		read_to_end = len(chunk) != file_size
+		# Only regular files are read to the end, a device could never end
+		if read_to_end and not stat.S_ISREG(os.fstat(fd).st_mode):
+			raise OSError("Not a regular file: {}".format(file_path))
+		while chunk:
+			hash_start = perf_counter()
+			read_seconds += hash_start - read_start
+			for h in hashes:
+				h.update(chunk)
+			read_start = perf_counter()
+			hash_seconds += read_start - hash_start
+			chunk = os.read(fd, _small_chunk_size) if read_to_end else b""
 	finally:
-		f.close()
-	# return the hex representation of digest
+		os.close(fd)
+	if timings is not None:
+		timings["read_seconds"] = timings.get("read_seconds", 0.0) + read_seconds + perf_counter() - read_start
+		timings["hash_seconds"] = timings.get("hash_seconds", 0.0) + hash_seconds
+	return [h.hexdigest() for h in hashes]
+# =============================================================================
+# Name:       get_read_order_key(location, inode)
+# Arguments:  location = directory of the file
+#             inode = inode number recorded at discovery, or None
+# Purpose:    Returns (directory, inode) sort key. Inode numbers follow the
+#             position of the files on disk on most filesystems, so reading in
+#             this order reduces seeking on spinning disks. Files read from a
+#             discovered list have no inode, they are left in list order (an
+#             empty key) rather than paying a stat call to sort them.
+# =============================================================================
+def get_read_order_key(location, inode):
+	if inode is None:
+		return ()
+	return location, inode
+# =============================================================================
+# Name:       hash_small_files_timed(file_paths, file_sizes, hash_type, file_inodes)
+# Arguments:  file_paths = list of small files
+#             file_sizes = their sizes from the discovered list
+#             hash_type = hash type to be used
+#             file_inodes = optional inodes recorded at discovery, None each
+#             where unknown
+# Purpose:    Returns (list of hash digest lists, list of timings dicts) in
+#             input order. A batch of files is one worker task, so pool
+#             scheduling is paid once per batch and not once per file. Files
+#             are read in get_read_order_key() order.
+# =============================================================================
+def hash_small_files_timed(file_paths, file_sizes, hash_type, file_inodes=None):
+	hash_types = get_hash_types(hash_type)
+	file_hashes = [None] * len(file_paths)
+	file_timings = [None] * len(file_paths)
+	read_order = range(len(file_paths))
+	if file_inodes is not None:
+		read_order = sorted(read_order, key=lambda index: get_read_order_key(os.path.dirname(file_paths[index]), file_inodes[index]))
+	for index in read_order:
+		timings = {}
+		try:
+			file_hashes[index] = hash_small_file(file_paths[index], file_sizes[index], hash_types, timings)
+		except Exception:
+			# Returns Dummy Hash Value '-------' to keep structure
+			file_hashes[index] = [get_dummy_hash_value(single_type) for single_type in hash_types]
+		file_timings[index] = timings
+	return file_hashes, file_timings
+# =============================================================================
+# Name:       get_row_inodes(items)
+# Arguments:  items = job items from Session.plan_hash_rows()
+# Purpose:    Returns inodes of the rows recorded at discovery, or None when
+#             not all of them are known (rows read from a discovered list).
+# =============================================================================
+def get_row_inodes(items):
+	file_inodes = [row.get('Inode') for row, _, _ in items]
+	if None in file_inodes:
+		return None
+	return file_inodes
+# =============================================================================
+# Name:       hash_partial(file_path, file_size, hash_type)
+# Arguments:  file_path = full path of the file
+#             file_size = size of the file from the discovered list
+#             hash_type = single hash type to be used
+# Purpose:    Returns hash of the head and tail of the file. Files up to twice
+#             _partial_hash_size are read whole, so their partial hash is a
+#             full hash. Returns None if the file can't be read.
+# =============================================================================
+def hash_partial(file_path, file_size, hash_type):
+	h = get_hash_object(hash_type)
+	try:
+		f, st = open_regular_file(file_path)
+		with f:
+			if file_size <= _partial_hash_size * 2:
+				h.update(f.read())
+			else:
+				h.update(f.read(_partial_hash_size))
+				f.seek(-_partial_hash_size, os.SEEK_END)
+				h.update(f.read(_partial_hash_size))
+	except OSError:
+		return None
 	return h.hexdigest()
+# =============================================================================
+# Name:       hash_full(file_path, hash_type, chunk_size, io_mode)
+# Arguments:  file_path = full path of the file
+#             hash_type = single hash type to be used
+#             chunk_size, io_mode = passed on to hash_file_digests()
+# Purpose:    Returns full hash of the file, or None if the file can't be read.
+# =============================================================================
+def hash_full(file_path, hash_type, chunk_size=0, io_mode="auto"):
+	try:
+		return hash_file_digests(file_path, [hash_type], chunk_size, io_mode)[0]
+	except Exception:
+		return None
+# =============================================================================
+# Name:       update_hashes(hashes, chunk)
+# Arguments:  hashes = list of hash objects
+#             chunk = bytes-like data read from a stream
+# Purpose:    Feeds the same chunk to every hash object
+# =============================================================================
+def update_hashes(hashes, chunk):
+	for h in hashes:
+		h.update(chunk)
+# =============================================================================
+# Name:       read_stream_chunks(stream, chunk_size)
+# Arguments:  stream = async iterable of bytes, or object with an async
+#             read(size) method such as asyncio.StreamReader
+#             chunk_size = bytes requested per read
+# Purpose:    Async generator yielding chunks of the stream as they arrive
+# =============================================================================
+async def read_stream_chunks(stream, chunk_size=_stream_chunk_size):
+	# StreamReader is also async iterable, but yields lines
+	if hasattr(stream, 'read'):
+		while True:
+			chunk = await stream.read(chunk_size)
+			if not chunk:
+				return
+			yield chunk
+	else:
+		async for chunk in stream:
+			if chunk:
+				yield chunk
+# =============================================================================
+# Name:       iter_async(iterable)
+# Arguments:  iterable = regular iterable
+# Purpose:    Async generator yielding the items of a regular iterable
+# =============================================================================
+async def iter_async(iterable):
+	for item in iterable:
+		yield item
+# =============================================================================
+# Section: Session List Functions
+# =============================================================================
+# =============================================================================
+# Name:       repair_csv_tail(csv_path)
+# Arguments:  csv_path = path of a csv file that might end with a partial row
+# Purpose:    Removes a row that was only partly written when session stopped.
+# =============================================================================
+def repair_csv_tail(csv_path):
+	with open(csv_path, 'r+b') as f:
+		file_end = f.seek(0, os.SEEK_END)
+		position = file_end
+		# Walk back in blocks until the last complete row ends
+		while position > 0:
+			block_start = max(0, position - 65536)
+			f.seek(block_start)
+			block = f.read(position - block_start)
+			if position == file_end and block.endswith(b'\n'):
+				return
+			newline_index = block.rfind(b'\n')
+			if newline_index != -1:
+				f.truncate(block_start + newline_index + 1)
+				return
+			position = block_start
+		f.truncate(0)
+# =============================================================================
+# Name:       BinaryListWriter(f)
+# Arguments:  f = list file opened for appending in binary mode
+# Purpose:    csv.writer replacement saving session lists in the binary
+#             format. The first row of a new file is the header, other rows
+#             are kept until flush() and appended as one block with:
+#               - Location as the number of the directory in the table of
+#                 the whole list, directories not saved yet go in the block
+#               - Size, Created and Modified as integers of the smallest width
+#                 that holds all values of the block
+#               - hash digests as raw bytes, with a status byte per row only
+#                 when the column mixes digests, empty and dummy hash values
+#                 (0 = empty, 1 = digest, 2 = dummy hash value)
+#             A resumed session appends to the list after reading its
+#             directory table, a partly written block can be dropped.
+# =============================================================================
+class BinaryListWriter:
+
+	def __init__(self, f):
+		self.file = f
+		self.header_saved = f.tell() > 0
+		self.pending_rows = []
+		# Directory numbers of the whole list
+		self.dir_ids = {}
+		if self.header_saved:
+			self.dir_ids = {dir_name: dir_id for dir_id, dir_name in enumerate(read_binary_directories(f.name))}
+
+	def writerow(self, row_data):
+		if not self.header_saved:
+			header = json.dumps([str(column) for column in row_data]).encode('utf8')
+			self.file.write(_binary_file_magic + struct.pack("<I", len(header)) + header)
+			self.header_saved = True
+		else:
+			self.pending_rows.append(row_data)
+	# =========================================================================
+	# Name:       flush()
+	# Purpose:    Appends pending rows to the file as a single block
+	# =========================================================================
+	def flush(self):
+		if not self.pending_rows:
+			return
+		rows, self.pending_rows = self.pending_rows, []
+		row_count = len(rows)
+		hash_columns = len(rows[0]) - 5
+
+		dir_ids = self.dir_ids
+		new_dirs = []
+		locations = []
+		for row in rows:
+			dir_id = dir_ids.get(row[0])
+			if dir_id is None:
+				dir_id = dir_ids[row[0]] = len(dir_ids)
+				new_dirs.append(row[0])
+			locations.append(dir_id)
+
+		payload = [
+			pack_binary_strings(new_dirs),
+			pack_binary_ints(locations),
+			pack_binary_ints([int(row[2]) for row in rows]),
+			pack_binary_ints([int(row[3]) for row in rows]),
+			pack_binary_ints([int(row[4]) for row in rows]),
+			pack_binary_strings([row[1] for row in rows]),
+		]
+		for column in range(5, 5 + hash_columns):
+			values = [row[column] or "" for row in rows]
+			# Digests and dummy hash values of a column share their length
+			digest_size = next((len(value) // 2 for value in values if value), 0)
+			statuses = bytes(0 if not value else 2 if value.startswith("-") else 1 for value in values)
+			# Column mode is the status of all rows, or 3 with a status per row
+			column_mode = statuses[0] if statuses.count(statuses[0]) == row_count else 3
+			payload.append(struct.pack("<HB", digest_size, column_mode))
+			if column_mode == 3:
+				payload.append(statuses)
+			payload.append(b"".join(bytes.fromhex(value) for value in values if value and not value.startswith("-")))
+		payload = b"".join(payload)
+		self.file.write(_binary_block_header.pack(_binary_block_magic, row_count, len(payload), hash_columns) + payload)
+# =============================================================================
+# Name:       pack_binary_ints(values)
+# Arguments:  values = list of integers
+# Purpose:    Returns the integers packed with the smallest struct type that
+#             holds all of them, after a byte with the type code.
+# =============================================================================
+def pack_binary_ints(values):
+	low, high = (min(values), max(values)) if values else (0, 0)
+	for code in ("BHIQ" if low >= 0 else "bhiq"):
+		bits = struct.calcsize(code) * 8
+		if (low >= 0 and high < 1 << bits) or (-(1 << (bits - 1)) <= low and high < 1 << (bits - 1)):
+			break
+	return code.encode() + struct.pack("<{}{}".format(len(values), code), *values)
+# =============================================================================
+# Name:       unpack_binary_ints(payload, offset, count)
+# Arguments:  payload = block payload
+#             offset = position of the integers in the payload
+#             count = number of integers
+# Purpose:    Returns (tuple of integers, offset after the integers)
+# =============================================================================
+def unpack_binary_ints(payload, offset, count):
+	int_format = "<{}{}".format(count, chr(payload[offset]))
+	return struct.unpack_from(int_format, payload, offset + 1), offset + 1 + struct.calcsize(int_format)
+# =============================================================================
+# Name:       pack_binary_strings(values)
+# Arguments:  values = list of strings
+# Purpose:    Returns count, lengths and utf8 bytes of the strings. Names that
+#             aren't valid utf8 on disk are kept with surrogateescape.
+# =============================================================================
+def pack_binary_strings(values):
+	encoded = [value.encode('utf8', 'surrogateescape') for value in values]
+	return struct.pack("<I", len(encoded)) + pack_binary_ints([len(value) for value in encoded]) + b"".join(encoded)
+# =============================================================================
+# Name:       unpack_binary_strings(payload, offset)
+# Arguments:  payload = block payload
+#             offset = position of the strings in the payload
+# Purpose:    Returns (list of strings, offset after the strings)
+# =============================================================================
+def unpack_binary_strings(payload, offset):
+	count, = struct.unpack_from("<I", payload, offset)
+	lengths, offset = unpack_binary_ints(payload, offset + 4, count)
+	ends = list(itertools.accumulate(lengths, initial=offset))
+	values = [payload[start:end].decode('utf8', 'surrogateescape') for start, end in zip(ends, ends[1:])]
+	return values, ends[-1]
+# =============================================================================
+# Name:       read_binary_blocks(list_path)
+# Arguments:  list_path = path of a list in the binary format
+# Purpose:    Yields the header row and then a (row_count, payload,
+#             hash_columns) tuple per complete block. A partly written block
+#             at the end of the list is ignored.
+# =============================================================================
+def read_binary_blocks(list_path):
+	with open(list_path, 'rb') as f:
+		file_header = f.read(len(_binary_file_magic) + 4)
+		if len(file_header) < len(_binary_file_magic) + 4:
+			return
+		if not file_header.startswith(_binary_file_magic):
+			raise ValueError('\n\n>>>>> Provided list is not a HashPy binary list!\n')
+		header_length, = struct.unpack_from("<I", file_header, len(_binary_file_magic))
+		header = f.read(header_length)
+		if len(header) < header_length:
+			return
+		yield json.loads(header.decode('utf8'))
+
+		while True:
+			block_header = f.read(_binary_block_header.size)
+			if len(block_header) < _binary_block_header.size:
+				return
+			block_magic, row_count, payload_length, hash_columns = _binary_block_header.unpack(block_header)
+			payload = f.read(payload_length)
+			if block_magic != _binary_block_magic or len(payload) < payload_length:
+				return
+			yield row_count, payload, hash_columns
+# =============================================================================
+# Name:       read_binary_directories(list_path)
+# Arguments:  list_path = path of a list in the binary format
+# Purpose:    Returns the directory table of the list, only the directories
+#             saved at the start of every block are decoded.
+# =============================================================================
+def read_binary_directories(list_path):
+	dir_names = []
+	blocks = read_binary_blocks(list_path)
+	next(blocks, None) # Skip header row
+	for row_count, payload, hash_columns in blocks:
+		dir_names.extend(unpack_binary_strings(payload, 0)[0])
+	return dir_names
+# =============================================================================
+# Name:       decode_binary_block(row_count, payload, hash_columns, dir_names, columns)
+# Arguments:  row_count, payload, hash_columns = block from read_binary_blocks()
+#             dir_names = directory table of the blocks read so far, the
+#             directories of this block are added to it
+#             columns = "sizes" to stop after the Size column, "files" to
+#             stop after the Name column or "all"
+# Purpose:    Returns (Location numbers in dir_names, Name list, Size tuple,
+#             Created tuple, Modified tuple, list of hash column lists),
+#             columns that aren't decoded are None.
+# =============================================================================
+def decode_binary_block(row_count, payload, hash_columns, dir_names, columns="all"):
+	new_dirs, offset = unpack_binary_strings(payload, 0)
+	dir_names.extend(new_dirs)
+	dir_ids, offset = unpack_binary_ints(payload, offset, row_count)
+	sizes, offset = unpack_binary_ints(payload, offset, row_count)
+	if columns == "sizes":
+		return dir_ids, None, sizes, None, None, None
+	created, offset = unpack_binary_ints(payload, offset, row_count)
+	modified, offset = unpack_binary_ints(payload, offset, row_count)
+	names, offset = unpack_binary_strings(payload, offset)
+	if columns == "files":
+		return dir_ids, names, sizes, created, modified, None
+
+	hashes = []
+	for column in range(hash_columns):
+		digest_size, column_mode = struct.unpack_from("<HB", payload, offset)
+		offset += 3
+		if column_mode == 3:
+			statuses = payload[offset:offset + row_count]
+			offset += row_count
+			digest_count = statuses.count(1)
+		elif column_mode == 1:
+			statuses = None
+			digest_count = row_count
+		else:
+			hashes.append(["-" * (digest_size * 2) if column_mode == 2 else ""] * row_count)
+			continue
+		digests = [payload[start:start + digest_size].hex() for start in range(offset, offset + digest_count * digest_size, digest_size or 1)]
+		offset += digest_count * digest_size
+		if statuses is not None:
+			# Put empty and dummy hash values in between the digests
+			digests = iter(digests)
+			dummy_hash = "-" * (digest_size * 2)
+			hashes.append([next(digests) if status == 1 else dummy_hash if status == 2 else "" for status in statuses])
+		else:
+			hashes.append(digests)
+	return dir_ids, names, sizes, created, modified, hashes
+# =============================================================================
+# Name:       repair_binary_tail(list_path)
+# Arguments:  list_path = path of a binary list that might end with a partial block
+# Purpose:    Removes a block that was only partly written when session stopped.
+# =============================================================================
+def repair_binary_tail(list_path):
+	with open(list_path, 'r+b') as f:
+		file_end = f.seek(0, os.SEEK_END)
+		f.seek(0)
+		file_header = f.read(len(_binary_file_magic) + 4)
+		if len(file_header) < len(_binary_file_magic) + 4:
+			f.truncate(0)
+			return
+		header_length, = struct.unpack_from("<I", file_header, len(_binary_file_magic))
+		position = len(file_header) + header_length
+		if position > file_end:
+			f.truncate(0)
+			return
+		# Skip from block to block until one is incomplete
+		while position + _binary_block_header.size <= file_end:
+			f.seek(position)
+			block_magic, row_count, payload_length, hash_columns = _binary_block_header.unpack(f.read(_binary_block_header.size))
+			block_end = position + _binary_block_header.size + payload_length
+			if block_magic != _binary_block_magic or block_end > file_end:
+				break
+			position = block_end
+		if position != file_end:
+			f.truncate(position)
+# =============================================================================
+# Name:       is_binary_list(list_path)
+# Arguments:  list_path = path of a session list
+# Purpose:    Returns True if the list is saved in the binary format
+# =============================================================================
+def is_binary_list(list_path):
+	return list_path.endswith(_list_extensions["binary"])
+# =============================================================================
+# Name:       get_list_path(dir_path, list_name, list_format)
+# Arguments:  dir_path = session config directory
+#             list_name = session_discovered_list or session_hashed_list
+#             list_format = csv or binary
+# Purpose:    Returns path of the list with the extension of the format
+# =============================================================================
+def get_list_path(dir_path, list_name, list_format):
+	return os.path.join(dir_path, os.path.splitext(list_name)[0] + _list_extensions[list_format])
+# =============================================================================
+# Name:       create_report_path(dir_path, report_name, extension)
+# Arguments:  dir_path = session results directory
+#             report_name = file name without extension, e.g. 'verify_<date>'
+#             extension = extension of the report, e.g. '.csv'
+# Purpose:    Creates an empty report file and returns its path. A number is
+#             added to the name when it is taken, e.g. by a report started in
+#             the same second, so reports never append to each other.
+# =============================================================================
+def create_report_path(dir_path, report_name, extension):
+	os.makedirs(dir_path, exist_ok=True)
+	for number in itertools.count(1):
+		report_path = os.path.join(dir_path, report_name + ("" if number == 1 else "_{}".format(number)) + extension)
+		try:
+			os.close(os.open(report_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+			return report_path
+		except FileExistsError:
+			continue
+# =============================================================================
+# Name:       read_list(list_path, start_row)
+# Arguments:  list_path = path of a csv or binary session list
+#             start_row = number of rows after the header to skip
+# Purpose:    Yields header and rows as lists of strings, same as csv.reader
+#             of the list in csv format. Binary blocks before start_row are
+#             skipped without decoding their rows.
+# =============================================================================
+def read_list(list_path, start_row=0):
+	if not is_binary_list(list_path):
+		with open(list_path, newline='', encoding='utf8') as csvfile:
+			reader = csv.reader(csvfile)
+			header = next(reader, None)
+			if header is None:
+				return
+			yield header
+			yield from itertools.islice(reader, start_row, None)
+		return
 
+	blocks = read_binary_blocks(list_path)
+	header = next(blocks, None)
+	if header is None:
+		return
+	yield header
+	dir_names = []
+	for row_count, payload, hash_columns in blocks:
+		if start_row >= row_count:
+			# Directories of skipped blocks are still used by later blocks
+			dir_names.extend(unpack_binary_strings(payload, 0)[0])
+			start_row -= row_count
+			continue
+		dir_ids, names, sizes, created, modified, hashes = decode_binary_block(row_count, payload, hash_columns, dir_names)
+		locations = map(dir_names.__getitem__, dir_ids)
+		rows = zip(locations, names, map(str, sizes), map(str, created), map(str, modified), *hashes)
+		yield from map(list, itertools.islice(rows, start_row, None))
+		start_row = 0
+# =============================================================================
+# Name:       read_list_dicts(list_path, start_row)
+# Arguments:  list_path = path of a csv or binary session list
+#             start_row = number of rows after the header to skip
+# Purpose:    Yields rows as dicts, same as csv.DictReader of the list.
 # =============================================================================
-# Name:       file_hasher()
-# Purpose:    Hashes all discovered files
+def read_list_dicts(list_path, start_row=0):
+	rows = read_list(list_path, start_row)
+	header = next(rows, None)
+	for row in rows:
+		yield dict(zip(header, row))
 # =============================================================================
-def file_hasher():
+# Name:       read_list_files(list_path)
+# Arguments:  list_path = path of a csv or binary session list
+# Purpose:    Yields (Location, Name, Size) of every listed file with Size as
+#             int. Binary lists are read by column and skip the hashes.
+# =============================================================================
+def read_list_files(list_path):
+	if not is_binary_list(list_path):
+		rows = read_list(list_path)
+		next(rows, None) # Skip header row
+		for row in rows:
+			yield row[0], row[1], int(row[2])
+		return
 
-	#Here Save first row with headers
-	csv_format_header = ["Location", "Name", "Size","Created","Modified","Hash"]
-	file_hashed_saving(csv_format_header)
+	blocks = read_binary_blocks(list_path)
+	next(blocks, None) # Skip header row
+	dir_names = []
+	for row_count, payload, hash_columns in blocks:
+		dir_ids, names, sizes, created, modified, hashes = decode_binary_block(row_count, payload, hash_columns, dir_names, "files")
+		yield from zip(map(dir_names.__getitem__, dir_ids), names, sizes)
+# =============================================================================
+# Name:       count_list_rows(list_path)
+# Arguments:  list_path = path of a csv or binary session list
+# Purpose:    Returns (rows including header, bytes of the listed files,
+#             [Location, Name] of the last row or None). Binary lists only
+#             decode the Size column and the directories, Name only for the
+#             last block.
+# =============================================================================
+def count_list_rows(list_path):
+	list_rows, list_bytes, last_row = 0, 0, None
+	if not is_binary_list(list_path):
+		with open(list_path, newline='', encoding='utf8') as csvfile:
+			reader = csv.reader(csvfile)
+			list_rows = 1 if next(reader, None) is not None else 0
+			for row in reader:
+				list_rows += 1
+				list_bytes += int(row[2])
+				last_row = row[:2]
+		return list_rows, list_bytes, last_row
 
-	with open(discovered_list_path, newline='') as csvfile:
-		reader = csv.DictReader(csvfile)
-		#current_csv_position = 0
+	blocks = read_binary_blocks(list_path)
+	list_rows = 1 if next(blocks, None) is not None else 0
+	dir_names = []
+	last_block = None
+	for row_count, payload, hash_columns in blocks:
+		last_dirs = len(dir_names)
+		dir_ids, names, sizes, created, modified, hashes = decode_binary_block(row_count, payload, hash_columns, dir_names, "sizes")
+		list_rows += row_count
+		list_bytes += sum(sizes)
+		last_block = (row_count, payload, hash_columns)
+	if last_block is not None:
+		# Directories of the last block are added again
+		del dir_names[last_dirs:]
+		dir_ids, names, sizes, created, modified, hashes = decode_binary_block(*last_block, dir_names, "files")
+		last_row = [dir_names[dir_ids[-1]], names[-1]]
+	return list_rows, list_bytes, last_row
+# =============================================================================
+# Name:       repair_list_tail(list_path)
+# Arguments:  list_path = path of a csv or binary session list
+# Purpose:    Removes a row or block that was only partly written.
+# =============================================================================
+def repair_list_tail(list_path):
+	if is_binary_list(list_path):
+		repair_binary_tail(list_path)
+	else:
+		repair_csv_tail(list_path)
+# =============================================================================
+# Name:       convert_list(source_path, target_path)
+# Arguments:  source_path = csv or binary session list
+#             target_path = converted list, format picked from its extension
+# Purpose:    Converts a session list between csv and binary format. Rows are
+#             streamed, so lists of any size are converted in flat memory.
+#             Returns number of rows converted, header included.
+# =============================================================================
+def convert_list(source_path, target_path):
+	converted_rows = 0
+	if is_binary_list(target_path):
+		with open(target_path, 'wb', buffering=_csv_buffer_size) as f:
+			writer = BinaryListWriter(f)
+			for row in read_list(source_path):
+				writer.writerow(row)
+				converted_rows += 1
+				if len(writer.pending_rows) >= _binary_block_rows:
+					writer.flush()
+			writer.flush()
+	else:
+		with open(target_path, 'w', newline='', encoding='utf8', buffering=_csv_buffer_size) as f:
+			writer = csv.writer(f)
+			for row in read_list(source_path):
+				writer.writerow(row)
+				converted_rows += 1
+	return converted_rows
+# =============================================================================
+# Name:       open_session_index(session_config_path)
+# Arguments:  session_config_path = path of a session 'hashpy.config'
+# Purpose:    Returns connection to the session index. Index is (re)built from
+#             'hashed_files.csv' (or 'discovered_files.csv' if nothing was
+#             hashed yet) when missing or older than the list. Rows are
+#             streamed in batches so memory doesn't grow with the session.
+# =============================================================================
+def open_session_index(session_config_path):
+	session_dir = os.path.dirname(os.path.abspath(session_config_path))
+	# Lists of the session in either format, hashed list preferred
+	source_paths = [get_list_path(session_dir, list_name, list_format)
+		for list_name in [session_hashed_list, session_discovered_list] for list_format in _list_extensions]
+	source_path = next((list_path for list_path in source_paths if os.path.isfile(list_path)), source_paths[-1])
+	source_st = os.stat(source_path)
+	source_state = "{}|{}|{}".format(source_path, source_st.st_size, source_st.st_mtime_ns)
 
-		for row in reader:
-			_Location = row['Location']
-			_Name = row['Name']
-			_Size = row['Size']
-			_Created = row['Created']
-			_Modified = row['Modified']
-			_Hash = row['Hash']
-			file_hash = ""
+	index = sqlite3.connect(os.path.join(session_dir, session_index_file))
+	index.row_factory = sqlite3.Row
+	index.execute("CREATE TABLE IF NOT EXISTS index_state (source TEXT NOT NULL)")
+	saved_state = index.execute("SELECT source FROM index_state").fetchone()
+	if saved_state is None or saved_state[0] != source_state:
+		build_session_index(index, source_path, source_state)
+	return index
+# =============================================================================
+# Name:       build_session_index(index, source_path, source_state)
+# Arguments:  index = session index connection
+#             source_path = csv list the index is built from
+#             source_state = path, size and mtime of the list when indexed
+# Purpose:    Rebuilds the session index tables from a csv list.
+# =============================================================================
+def build_session_index(index, source_path, source_state):
+	index.executescript("""
+		DROP TABLE IF EXISTS files;
+		DROP TABLE IF EXISTS hashes;
+		DELETE FROM index_state;
+		CREATE TABLE files (
+			id INTEGER PRIMARY KEY,
+			Location TEXT NOT NULL,
+			Name TEXT NOT NULL,
+			Size INTEGER NOT NULL,
+			Created INTEGER,
+			Modified INTEGER);
+		CREATE TABLE hashes (
+			file_id INTEGER NOT NULL,
+			column TEXT NOT NULL,
+			digest TEXT NOT NULL);""")
 
-			if _Hash == "":
-				# Print  Hashing Status - important to display hashing before file is actually hashed
-				end_of_file = (_hashed_files_count + 1 == _discovered_files_count)
-				display_hashing_status([_Location,_Name,_Size,_Created,_Modified,file_hash], end_of_file)
+	reader = read_list(source_path)
+	header = next(reader, [])
+	hash_columns = [(position, column) for position, column in enumerate(header) if column.startswith("Hash")]
+	file_id = 0
+	while True:
+		batch = list(itertools.islice(reader, _index_batch_rows))
+		if not batch:
+			break
+		file_rows, hash_rows = [], []
+		for row in batch:
+			file_id += 1
+			file_rows.append((file_id, row[0], row[1], int(row[2]), row[3], row[4]))
+			hash_rows.extend((file_id, column, row[position]) for position, column in hash_columns if row[position])
+		index.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", file_rows)
+		index.executemany("INSERT INTO hashes VALUES (?, ?, ?)", hash_rows)
 
-				#If hash value is empty then proceed with hashing
-				file_path = os.path.join(_Location,_Name)
-				#file_hash = hash_file(file_path)
-				try:
-					file_hash = hash_file(file_path)
-				except Exception:
-					file_hash = get_dummy_hash_value() # Returns Dummy Hash Value '-------' to keep structure
-				# Update current_file_info
-				hashed_file_data = [_Location,_Name,_Size,_Created,_Modified,file_hash]
-				file_hashed_saving(hashed_file_data)
+	# Indexes are created after loading, which is faster than keeping them updated
+	index.executescript("""
+		CREATE INDEX files_path ON files (Location, Name);
+		CREATE INDEX files_size ON files (Size);
+		CREATE INDEX hashes_digest ON hashes (digest);
+		CREATE INDEX hashes_file ON hashes (file_id);""")
+	index.execute("INSERT INTO index_state VALUES (?)", (source_state,))
+	index.commit()
+# =============================================================================
+# Name:       query_rows(index, where, parameters)
+# Arguments:  index = session index connection
+#             where = sql condition on the files table
+#             parameters = values for the condition
+# Purpose:    Yields matching files as dicts with the same keys as csv rows.
+# =============================================================================
+def query_rows(index, where, parameters):
+	cursor = index.execute("SELECT * FROM files WHERE " + where, parameters)
+	for file_row in cursor:
+		row = dict(file_row)
+		file_id = row.pop('id')
+		for hash_row in index.execute("SELECT column, digest FROM hashes WHERE file_id=?", (file_id,)):
+			row[hash_row['column']] = hash_row['digest']
+		yield row
+# =============================================================================
+# Name:       query_path(index, file_path)
+# Arguments:  index = session index connection
+#             file_path = full path of the file as it was discovered
+# Purpose:    Yields saved rows of the file.
+# =============================================================================
+def query_path(index, file_path):
+	location, name = os.path.split(file_path)
+	return query_rows(index, "Location=? AND Name=?", (location, name))
+# =============================================================================
+# Name:       query_hash(index, file_hash)
+# Arguments:  index = session index connection
+#             file_hash = hex digest in any of the hash columns
+# Purpose:    Yields saved rows of files with the hash.
+# =============================================================================
+def query_hash(index, file_hash):
+	return query_rows(index, "id IN (SELECT file_id FROM hashes WHERE digest=?)", (file_hash.lower(),))
+# =============================================================================
+# Name:       query_size(index, min_size, max_size)
+# Arguments:  index = session index connection
+#             min_size, max_size = size range in bytes, None for an open side
+# Purpose:    Yields saved rows of files within the size range.
+# =============================================================================
+def query_size(index, min_size=None, max_size=None):
+	min_size = 0 if min_size is None else min_size
+	max_size = sys.maxsize if max_size is None else max_size
+	return query_rows(index, "Size BETWEEN ? AND ? ORDER BY Size", (min_size, max_size))
+# =============================================================================
+# Name:       run_session_queries(session_config_path, query_path_value,
+#             query_hash_value, query_size_value, output)
+# Arguments:  session_config_path = path of a session 'hashpy.config'
+#             query_path_value = full path of a file, or None
+#             query_hash_value = hex digest, or None
+#             query_size_value = (min_size, max_size) tuple, or None
+#             output = file the csv rows are written to, defaults to stdout
+# Purpose:    Prints results of session queries to console as csv. Only the
+#             session folder is read, so sessions of trees that are gone (e.g.
+#             an unmounted disk) can still be queried.
+# =============================================================================
+def run_session_queries(session_config_path, query_path_value=None, query_hash_value=None, query_size_value=None, output=None):
+	index = open_session_index(session_config_path)
+	writer = None
+	try:
+		queries = []
+		if query_path_value is not None:
+			queries.append(query_path(index, query_path_value))
+		if query_hash_value is not None:
+			queries.append(query_hash(index, query_hash_value))
+		if query_size_value is not None:
+			queries.append(query_size(index, *query_size_value))
+		for row in itertools.chain(*queries):
+			if writer is None:
+				writer = csv.DictWriter(output or sys.stdout, fieldnames=list(row), lineterminator='\n')
+				writer.writeheader()
+			writer.writerow(row)
+	finally:
+		index.close()
+# =============================================================================
+# Section: Benchmark Functions
+# =============================================================================
+# =============================================================================
+# Name:       generate_bench_tree(root_path, tree_name)
+# Arguments:  root_path = temporary benchmark directory
+#             tree_name = tiny, huge or deep
+# Purpose:    Creates a synthetic tree and returns (path, files, bytes)
+# =============================================================================
+def generate_bench_tree(root_path, tree_name):
+	tree_path = os.path.join(root_path, tree_name)
+	os.makedirs(tree_path)
+	# Random block repeated so generating the data doesn't dominate
+	block = os.urandom(1024 * 1024)
+
+	if tree_name == "tiny":
+		file_paths = [(os.path.join(tree_path, "tiny_{}".format(number)), _bench_tiny_size) for number in range(_bench_tiny_files)]
+	elif tree_name == "huge":
+		file_paths = [(os.path.join(tree_path, "huge_{}".format(number)), _bench_huge_size) for number in range(_bench_huge_files)]
+	else:
+		file_paths = []
+		dir_path = tree_path
+		for level in range(_bench_deep_levels):
+			dir_path = os.path.join(dir_path, "level_{}".format(level))
+			os.makedirs(dir_path)
+			file_paths += [(os.path.join(dir_path, "deep_{}".format(number)), _bench_deep_size) for number in range(_bench_deep_files)]
+
+	for file_path, file_size in file_paths:
+		with open(file_path, 'wb') as f:
+			remaining = file_size
+			while remaining > 0:
+				f.write(block[:remaining])
+				remaining -= len(block)
+	return tree_path, len(file_paths), sum(file_size for file_path, file_size in file_paths)
+# =============================================================================
+# Name:       read_syscall_count()
+# Purpose:    Returns number of read and write syscalls made by this process,
+#             or None where /proc/self/io is not available.
+# =============================================================================
+def read_syscall_count():
+	try:
+		with open('/proc/self/io') as f:
+			counters = dict(line.split(":") for line in f if ":" in line)
+		return int(counters['syscr']) + int(counters['syscw'])
+	except (OSError, KeyError, ValueError):
+		return None
+# =============================================================================
+# Name:       bench_measure(bench_results, bench_name, bench_function, files,
+#             size, count_syscalls)
+# Arguments:  bench_results = list the measurement is added to
+#             bench_name = name of the measurement
+#             bench_function = function being measured, called without arguments
+#             files, size = number of files and bytes it processes, size can be
+#             a function called after the run, e.g. for bytes written, or
+#             None where no file content is processed (MB/s is null)
+#             count_syscalls = False where read and write syscalls are not the
+#             work being measured (discovery makes stat and getdents calls)
+# Purpose:    Times a function and adds MB/s, files/s and read and write
+#             syscalls per file (null where not counted).
+# =============================================================================
+def bench_measure(bench_results, bench_name, bench_function, files, size, count_syscalls=True):
+	syscalls_before = read_syscall_count() if count_syscalls else None
+	start = perf_counter()
+	bench_function()
+	seconds = max(perf_counter() - start, 1e-9)
+	syscalls_after = read_syscall_count() if count_syscalls else None
+	if callable(size):
+		size = size()
+
+	result = collections.OrderedDict([
+		("name", bench_name),
+		("seconds", round(seconds, 6)),
+		("files", files),
+		("bytes", size),
+		("mb_per_s", None if size is None else round(size / seconds / (1024 * 1024), 2)),
+		("files_per_s", round(files / seconds, 2)),
+		("read_write_syscalls_per_file", None),
+	])
+	if syscalls_before is not None and syscalls_after is not None and files:
+		result["read_write_syscalls_per_file"] = round((syscalls_after - syscalls_before) / files, 2)
+	bench_results.append(result)
+	mb_per_s = "-" if result["mb_per_s"] is None else "{:.1f} MB/s".format(result["mb_per_s"])
+	print ("{:<2}{:<40}{:>16}{:>18}".format('', bench_name, mb_per_s, "{:.0f} files/s".format(result["files_per_s"])))
+# =============================================================================
+# Name:       bench_hashing(tree_path, hash_type, chunk_size, io_mode)
+# Purpose:    Hashes all files in a benchmark tree.
+# =============================================================================
+def bench_hashing(tree_path, hash_type, chunk_size, io_mode):
+	for dir_path, directories, files in os.walk(tree_path):
+		for file_name in files:
+			hash_file_digests(os.path.join(dir_path, file_name), [hash_type], chunk_size, io_mode)
+# =============================================================================
+# Section: Hasher
+# =============================================================================
+# =============================================================================
+# Name:       Hasher(hash_type, workers, pool_type, chunk_size, io_mode,
+#             device_workers)
+# Arguments:  hash_type = one or more hash types, e.g. "MD5,SHA256"
+#             workers = number of files hashed in parallel, per device when
+#             hashing a session
+#             pool_type = thread or process, worker pool used when workers > 1
+#             chunk_size = read chunk size in bytes, 0 = adaptive
+#             io_mode = file read engine: read, mmap or auto
+#             device_workers = optional dict of path to number of workers for
+#             the device holding the path, e.g. {"/mnt/hdd": 1}
+# Purpose:    Hashing settings with worker pools that are created on first
+#             use and kept until close(), so several sessions (also running
+#             on different threads) can share them. Next to the main pool
+#             every device gets its own pool, so the limit of a device holds
+#             for all sessions hashing from it.
+# =============================================================================
+class Hasher:
+
+	def __init__(self, hash_type="MD5", workers=1, pool_type="thread", chunk_size=0, io_mode="auto", device_workers=None):
+		self.hash_type = validate_hash_type(hash_type)
+		self.hash_types = get_hash_types(self.hash_type)
+		self.workers = validate_workers(workers)
+		self.pool_type = validate_pool_type(pool_type)
+		self.chunk_size = validate_chunk_size(chunk_size)
+		self.io_mode = validate_io_mode(io_mode)
+		self.device_workers = {}
+		self._device_limits = {}					# st_dev: number of workers
+		for device_path, path_workers in (device_workers or {}).items():
+			self.device_workers[device_path] = validate_workers(path_workers)
+			try:
+				self._device_limits[os.stat(device_path).st_dev] = self.device_workers[device_path]
+			except OSError:
+				pass # Path not mounted anymore, its device uses the default
+		self._pools = {}							# None is the main pool, others by st_dev
+		self._pool_lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+	# =========================================================================
+	# Name:       get_device_workers(device)
+	# Arguments:  device = st_dev of a device, None for the main pool
+	# Purpose:    Returns number of workers of the device
+	# =========================================================================
+	def get_device_workers(self, device=None):
+		return self._device_limits.get(device, self.workers)
+	# =========================================================================
+	# Name:       get_pool(device)
+	# Arguments:  device = st_dev of a device, None for the main pool
+	# Purpose:    Returns the worker pool of the device, created on first use
+	# =========================================================================
+	def get_pool(self, device=None):
+		with self._pool_lock:
+			pool = self._pools.get(device)
+			if pool is None:
+				if self.pool_type == "process":
+					pool = ProcessPoolExecutor(max_workers=self.get_device_workers(device))
+				else:
+					pool = ThreadPoolExecutor(max_workers=self.get_device_workers(device))
+				self._pools[device] = pool
+			return pool
+	# =========================================================================
+	# Name:       close()
+	# Purpose:    Waits for hashed files and shuts the worker pools down. The
+	#             pools are created again if the hasher is used afterwards.
+	# =========================================================================
+	def close(self):
+		with self._pool_lock:
+			pools, self._pools = list(self._pools.values()), {}
+		for pool in pools:
+			pool.shutdown()
+	# =========================================================================
+	# Name:       hash_file(file_path)
+	# Arguments:  file_path = full path of the file
+	# Purpose:    Returns hash digest, or list of digests for several hash types
+	# =========================================================================
+	def hash_file(self, file_path):
+		return hash_file(file_path, self.hash_type, self.chunk_size, self.io_mode)
+	# =========================================================================
+	# Name:       hash_file_timed(file_path)
+	# Arguments:  file_path = full path of the file
+	# Purpose:    Returns (list of hash digests, timings dict) on this thread
+	# =========================================================================
+	def hash_file_timed(self, file_path):
+		return hash_file_timed(file_path, self.hash_type, self.chunk_size, self.io_mode)
+	# =========================================================================
+	# Name:       submit(file_path, device)
+	# Arguments:  file_path = full path of the file
+	#             device = st_dev of the file to use its device pool, or None
+	# Purpose:    Returns future of (list of hash digests, timings dict)
+	# =========================================================================
+	def submit(self, file_path, device=None):
+		return self.get_pool(device).submit(hash_file_timed, file_path, self.hash_type, self.chunk_size, self.io_mode)
+	# =========================================================================
+	# Name:       hash_small_files_timed(file_paths, file_sizes, file_inodes)
+	# Arguments:  file_paths = list of small files
+	#             file_sizes = their sizes from the discovered list
+	#             file_inodes = optional inodes recorded at discovery
+	# Purpose:    Returns hash_small_files_timed() of the batch on this thread
+	# =========================================================================
+	def hash_small_files_timed(self, file_paths, file_sizes, file_inodes=None):
+		return hash_small_files_timed(file_paths, file_sizes, self.hash_type, file_inodes)
+	# =========================================================================
+	# Name:       submit_small(file_paths, file_sizes, device, file_inodes)
+	# Arguments:  file_paths = list of small files
+	#             file_sizes = their sizes from the discovered list
+	#             device = st_dev of the files to use its device pool, or None
+	#             file_inodes = optional inodes recorded at discovery
+	# Purpose:    Returns future of hash_small_files_timed() of the batch
+	# =========================================================================
+	def submit_small(self, file_paths, file_sizes, device=None, file_inodes=None):
+		return self.get_pool(device).submit(hash_small_files_timed, file_paths, file_sizes, self.hash_type, file_inodes)
+	# =========================================================================
+	# Name:       map(function, *iterables)
+	# Arguments:  function = module level function, so it can go to a process pool
+	#             iterables = arguments of each call
+	# Purpose:    Returns results in order, on the worker pool when workers > 1
+	# =========================================================================
+	def map(self, function, *iterables):
+		if self.workers > 1:
+			return self.get_pool().map(function, *iterables)
+		return map(function, *iterables)
+	# =========================================================================
+	# Name:       map_partial(file_paths, file_size)
+	# Arguments:  file_paths = list of files sharing a size
+	#             file_size = size shared by the files
+	# Purpose:    Returns hash_partial() of each file with the first hash type
+	# =========================================================================
+	def map_partial(self, file_paths, file_size):
+		return self.map(hash_partial, file_paths, itertools.repeat(file_size), itertools.repeat(self.hash_types[0]))
+	# =========================================================================
+	# Name:       map_full(file_paths)
+	# Arguments:  file_paths = list of files
+	# Purpose:    Returns hash_full() of each file with the first hash type
+	# =========================================================================
+	def map_full(self, file_paths):
+		return self.map(hash_full, file_paths, itertools.repeat(self.hash_types[0]),
+			itertools.repeat(self.chunk_size), itertools.repeat(self.io_mode))
+	# =========================================================================
+	# Name:       hash_file_async(file_path)
+	# Arguments:  file_path = full path of the file
+	# Purpose:    Coroutine returning hash_file() of the file. The file is read
+	#             and hashed on the worker pool so the event loop isn't blocked.
+	# =========================================================================
+	async def hash_file_async(self, file_path):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.get_pool(), hash_file, file_path, self.hash_type, self.chunk_size, self.io_mode)
+	# =========================================================================
+	# Name:       hash_files_async(file_paths)
+	# Arguments:  file_paths = iterable or async iterable of full file paths
+	# Purpose:    Async generator yielding (file_path, list of hash digests) in
+	#             input order. At most workers * 4 files are in flight, files
+	#             that can't be read get dummy hash values like in a session.
+	# =========================================================================
+	async def hash_files_async(self, file_paths):
+		loop = asyncio.get_running_loop()
+		max_in_flight = self.workers * 4
+		in_flight = collections.deque()
+
+		if not hasattr(file_paths, '__aiter__'):
+			file_paths = iter_async(file_paths)
+		async for file_path in file_paths:
+			in_flight.append((file_path, loop.run_in_executor(self.get_pool(), hash_file_safe, file_path, self.hash_type, self.chunk_size, self.io_mode)))
+			# Wait for the oldest file so results are returned in order
+			if len(in_flight) >= max_in_flight:
+				done_path, future = in_flight.popleft()
+				yield done_path, await future
+		while in_flight:
+			done_path, future = in_flight.popleft()
+			yield done_path, await future
+	# =========================================================================
+	# Name:       hash_stream_async(stream)
+	# Arguments:  stream = async iterable of bytes, or object with an async
+	#             read(size) method such as asyncio.StreamReader
+	# Purpose:    Coroutine returning hash digest (or list of digests, same as
+	#             hash_file()) of the stream, hashed while it arrives without
+	#             keeping the payload. Large chunks are hashed on the default
+	#             executor while the next chunk is awaited, hash objects can't
+	#             be sent to a process pool.
+	# =========================================================================
+	async def hash_stream_async(self, stream):
+		loop = asyncio.get_running_loop()
+		hashes = [get_hash_object(hash_type) for hash_type in self.hash_types]
+		pending_update = None
+
+		async for chunk in read_stream_chunks(stream, self.chunk_size or _stream_chunk_size):
+			# Chunks must reach the hash objects in order
+			if pending_update is not None:
+				await pending_update
+				pending_update = None
+			if len(chunk) <= _stream_inline_size:
+				update_hashes(hashes, chunk)
 			else:
+				# Copy so a producer reusing its buffer can't change queued data
+				pending_update = loop.run_in_executor(None, update_hashes, hashes, bytes(chunk))
+		if pending_update is not None:
+			await pending_update
+
+		digests = [h.hexdigest() for h in hashes]
+		if len(digests) == 1:
+			return digests[0]
+		return digests
+# =============================================================================
+# Section: Session
+# =============================================================================
+# =============================================================================
+# Name:       Session(target_path, hasher, recursive, verbose, cache_mode,
+#             discovery_workers, stream, metrics_file, list_format, ...)
+# Arguments:  target_path = file or directory to hash
+#             hasher = Hasher shared with other sessions, one is created from
+#             hash_type, workers, pool_type, chunk_size and io_mode otherwise
+#             recursive = discover files in sub directories
+#             verbose = display progress in console
+#             cache_mode = hash cache: off, trust or verify
+#             discovery_workers = directories scanned in parallel
+#             stream = hash files while discovery is running
+#             metrics_file = JSON lines file for metrics snapshots
+#             list_format = csv or binary, format of discovered and hashed lists
+#             include, exclude, min_size, max_size, one_file_system, max_depth
+#             = discovery filters, see DiscoveryFilter
+#             follow_symlinks = symlink policy: never, files or all
+#             local_path = directory holding 'Sessions', defaults to the script
+#             loaded_file, session_datetime = set by Session.load()
+# Purpose:    State of a single hashing session: settings, session files,
+#             counters and metrics. Sessions don't share state, so several of
+#             them can run at the same time on different threads.
+# =============================================================================
+class Session:
+
+	def __init__(self, target_path, hasher=None, recursive=False, verbose=False, cache_mode="off",
+			discovery_workers=1, stream=False, metrics_file=None, list_format="csv",
+			include=None, exclude=None, min_size=None, max_size=None, one_file_system=False, max_depth=None,
+			follow_symlinks="files", local_path=None,
+			hash_type="MD5", workers=1, pool_type="thread", chunk_size=0, io_mode="auto", device_workers=None,
+			loaded_file=None, session_datetime=None, discovery_complete=True):
+		self.loaded = loaded_file is not None
+		# False while a streamed session is still discovering files
+		self.discovery_complete = discovery_complete
+		self.local_path = session_local_path if local_path is None else local_path
+		self.target_path = validate_target(target_path, self.loaded)
+		self.recursive_search = recursive
+		self.verbose_mode = verbose
+		self.cache_mode = validate_cache_mode(cache_mode, self.loaded)
+		self.discovery_workers = validate_workers(discovery_workers, self.loaded)
+		self.stream_mode = stream
+		self.list_format = validate_list_format(list_format, self.loaded)
+		self.metrics_file = os.path.abspath(metrics_file) if metrics_file else None
+		# Discovery filters
+		self.include_rules = [validate_filter_rule(rule, self.loaded) for rule in include or []]
+		self.exclude_rules = [validate_filter_rule(rule, self.loaded) for rule in exclude or []]
+		self.min_size = None if min_size is None else validate_file_size(min_size, self.loaded)
+		self.max_size = None if max_size is None else validate_file_size(max_size, self.loaded)
+		self.one_file_system = one_file_system
+		self.max_depth = None if max_depth is None else validate_max_depth(max_depth, self.loaded)
+		self.follow_symlinks = validate_follow_symlinks(follow_symlinks, self.loaded)
+		# Hasher created here is closed with the session, a shared one is not
+		self._owns_hasher = hasher is None
+		self.hasher = Hasher(hash_type, workers, pool_type, chunk_size, io_mode, device_workers) if hasher is None else hasher
+
+		if self.loaded:
+			self.session_datetime = session_datetime
+			# Session files are kept next to the loaded config file
+			self.config_dir_path = os.path.dirname(os.path.abspath(loaded_file))
+		else:
+			self.session_datetime = self.reserve_session_dir()
+			self.config_dir_path = os.path.join(self.local_path,session_main_dir,self.session_datetime,session_config_dir)
+		# Path for config file
+		self.config_file_path = os.path.join(self.config_dir_path,session_config_file)
+		self.loaded_file = loaded_file if self.loaded else self.config_file_path
+		# Path for discovered_files file
+		self.discovered_list_path = get_list_path(self.config_dir_path,session_discovered_list,self.list_format)
+		# Path for hashed files status file  ('hashed_files_status.txt')
+		self.hashed_list_path = get_list_path(self.config_dir_path,session_hashed_list,self.list_format)
+		# Path for session results, next to the config directory
+		self.results_dir_path = os.path.join(os.path.dirname(self.config_dir_path),session_results_dir)
+		# Path for duplicate file groups
+		self.duplicates_list_path = os.path.join(self.results_dir_path,session_duplicates_list)
+		# Path for verify report, named when verify starts
+		self.verify_list_path = None
+		# Path for hash cache shared between sessions
+		self.cache_file_path = os.path.join(self.local_path,session_main_dir,session_cache_file)
+
+		# Display state
+		self._last_output_length = 0
+		self._last_display_time = 0.0
+		# Output tracking
+		self._discovered_files_count = 0
+		self._hashed_files_count = 0
+		self._discovery_running = False				# True while streaming discovery is running
+		self._location_devices = {}					# Directory: st_dev, for the device pools
+		self._entry_counts = collections.Counter()	# Hardlinks and skipped entries by type
+		# Files reached through several links, hashed once per inode
+		self._link_paths = {}						# normalized file path: (device, inode)
+		self._link_paths_left = collections.Counter()	# (device, inode): paths not hashed yet
+		self._link_planned = set()					# (device, inode) read through a path planned already
+		self._link_hashes = {}						# (device, inode): hashes of the path read
+		self._dedupe_stats = {"files": 0, "bytes_total": 0, "bytes_read": 0, "groups": 0, "duplicates": 0, "reclaimable": 0}
+		self._cache_stats = {"hits": 0, "misses": 0, "mismatches": 0, "bytes_skipped": 0, "errors": 0}
+		self._cache_uncommitted = 0					# Cache rows stored since the last commit
+		self._cache_last_commit = 0.0
+		self._verify_stats = collections.Counter()
+		# Metrics
+		self._metrics = collections.OrderedDict([
+			("phase", "idle"),
+			("phase_started", monotonic()),
+			("files_discovered", 0),
+			("bytes_discovered", 0),
+			("files_hashed", 0),
+			("bytes_hashed", 0),
+			("files_cached", 0),
+			("bytes_cached", 0),
+			("files_linked", 0),
+			("bytes_linked", 0),
+			("bytes_resumed", 0),
+			("stat_seconds", 0.0),
+			("read_seconds", 0.0),
+			("hash_seconds", 0.0),
+			("mapped_seconds", 0.0),
+			("write_seconds", 0.0),
+		])
+		self._metrics_lock = threading.Lock()		# Discovery and hashing can run together
+		self._metrics_hooks = []					# Functions called with every snapshot
+		self._metrics_last_emit = 0.0
+		# Open csv writers by file path
+		self._csv_writers = {}
+
+		if self.metrics_file is not None:
+			self.add_metrics_hook(self.metrics_file_saving)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+	# =========================================================================
+	# Name:       load(config_path, hasher, local_path)
+	# Arguments:  config_path = path of a session 'hashpy.config'
+	#             hasher = optional shared Hasher, must use the saved hash type
+	#             local_path = directory holding 'Sessions', used for the cache
+	# Purpose:    Returns the session saved in config_path, ready to resume.
+	# =========================================================================
+	@classmethod
+	def load(cls, config_path, hasher=None, local_path=None):
+		# Load settings from file
+		config = configparser.ConfigParser()
+		try:
+			config.read(config_path)
+		except configparser.Error:
+			config.clear()
+		if not config.has_section('settings'):
+			raise InvalidSettingError('\n>>>>> Loaded file is not a HashPy session config!\n')
+		settings = config['settings']
+		hash_type = validate_hash_type(settings['session_hash_type'], True)
+		if hasher is not None and hasher.hash_type != hash_type:
+			raise ValueError('\n\n>>>>> Provided hasher doesn\'t use the hash type of the loaded session!\n')
+
+		return cls(settings['session_target_path'], hasher,
+			recursive=settings.getboolean('session_recursive_search'),
+			verbose=settings.getboolean('session_verbose_mode'),
+			cache_mode=settings.get('session_cache_mode', 'off'),
+			discovery_workers=settings.get('session_discovery_workers', '1'),
+			stream=settings.getboolean('session_stream_mode', False),
+			list_format=settings.get('session_list_format', 'csv'),
+			metrics_file=settings.get('session_metrics_file', '') or None,
+			include=json.loads(settings.get('session_include', '[]')),
+			exclude=json.loads(settings.get('session_exclude', '[]')),
+			min_size=settings.get('session_min_size', '') or None,
+			max_size=settings.get('session_max_size', '') or None,
+			one_file_system=settings.getboolean('session_one_file_system', False),
+			max_depth=settings.get('session_max_depth', '') or None,
+			follow_symlinks=settings.get('session_follow_symlinks', 'files'),
+			local_path=local_path,
+			hash_type=hash_type,
+			workers=validate_workers(settings.get('session_workers', '1'), True),
+			pool_type=validate_pool_type(settings.get('session_pool_type', 'thread'), True),
+			chunk_size=validate_chunk_size(settings.get('session_chunk_size', '0'), True),
+			io_mode=validate_io_mode(settings.get('session_io_mode', 'auto'), True),
+			device_workers=dict((device_path, validate_workers(path_workers, True))
+				for device_path, path_workers in json.loads(settings.get('session_device_workers', '{}')).items()),
+			loaded_file=config_path,
+			session_datetime=settings['session_datetime'],
+			discovery_complete=settings.getboolean('session_discovery_complete', True))
+	# =========================================================================
+	# Name:       reserve_session_dir()
+	# Purpose:    Creates the session directory named after the current date
+	#             and time and returns its name. Sessions started in the same
+	#             second get a numbered suffix instead of sharing a directory.
+	# =========================================================================
+	def reserve_session_dir(self):
+		session_datetime = str(strftime("%Y-%m-%d@%H-%M-%S", localtime()))
+		sessions_dir_path = os.path.join(self.local_path,session_main_dir)
+		os.makedirs(sessions_dir_path, exist_ok=True)
+		for number in itertools.count(1):
+			session_name = session_datetime if number == 1 else "{}_{}".format(session_datetime, number)
+			try:
+				os.mkdir(os.path.join(sessions_dir_path, session_name))
+				return session_name
+			except FileExistsError:
+				continue
+	# =========================================================================
+	# Name:       close()
+	# Purpose:    Flushes and closes session files and stops the metrics file.
+	#             Rows saved so far are kept for resuming the session.
+	# =========================================================================
+	def close(self):
+		self.csv_closing()
+		if self.metrics_file is not None:
+			self.remove_metrics_hook(self.metrics_file_saving)
+		if self._owns_hasher:
+			self.hasher.close()
+	# =========================================================================
+	# Name:       run(dedupe)
+	# Arguments:  dedupe = True to find duplicate files instead of hashing
+	# Purpose:    Discovers files (or restores a loaded session) and hashes them
+	# =========================================================================
+	def run(self, dedupe=False):
+		if self.loaded and not self.discovery_complete:
+			# Streamed session was stopped during discovery
+			self.resume_file_discovery()
+		elif self.loaded and os.path.isfile(self.discovered_list_path):
+			# Discovery of the loaded session is complete, no need to repeat it
+			self.load_discovery_progress()
+		elif self.stream_mode and not dedupe:
+			# Saved before streaming so a stopped session can be resumed
+			self.save_settings(False)
+			self.stream_file_hasher()
+			return
+		else:
+			self.file_discovery()
+		self.save_settings()
+		if dedupe:
+			self.find_duplicates()
+		else:
+			self.file_hasher()
+	# =========================================================================
+	# Name:       save_settings(discovery_complete)
+	# Arguments:  discovery_complete = False when saved before streaming
+	# Purpose:    Saves current settings to session folder, ignores if loaded
+	#             unless the loaded session has just completed its discovery.
+	# =========================================================================
+	def save_settings(self, discovery_complete=True):
+		if(self.loaded == False or not self.discovery_complete):
+			self.discovery_complete = discovery_complete
+			config = configparser.ConfigParser()
+			config['settings'] = {
+			'session_target_path': self.target_path,
+			'session_recursive_search': self.recursive_search,
+			'session_hash_type': self.hasher.hash_type,
+			'session_verbose_mode': self.verbose_mode,
+			'session_workers': self.hasher.workers,
+			'session_pool_type': self.hasher.pool_type,
+			'session_chunk_size': self.hasher.chunk_size,
+			'session_io_mode': self.hasher.io_mode,
+			'session_device_workers': json.dumps(self.hasher.device_workers).replace('%', '%%'),
+			'session_cache_mode': self.cache_mode,
+			'session_discovery_workers': self.discovery_workers,
+			'session_stream_mode': self.stream_mode,
+			'session_list_format': self.list_format,
+			'session_metrics_file': (self.metrics_file or '').replace('%', '%%'),
+			# Rules are saved as JSON lists, % is doubled for configparser
+			'session_include': json.dumps(self.include_rules).replace('%', '%%'),
+			'session_exclude': json.dumps(self.exclude_rules).replace('%', '%%'),
+			'session_min_size': '' if self.min_size is None else self.min_size,
+			'session_max_size': '' if self.max_size is None else self.max_size,
+			'session_one_file_system': self.one_file_system,
+			'session_max_depth': '' if self.max_depth is None else self.max_depth,
+			'session_follow_symlinks': self.follow_symlinks,
+			'session_datetime': self.session_datetime,
+			'session_discovery_complete': self.discovery_complete
+			}
+			# Create folder for current session
+			os.makedirs(self.config_dir_path, exist_ok=True)
+			# Create/Open File in directory for new session
+			with open(self.config_file_path, 'w', encoding='utf8') as f:
+				config.write(f)
+	# =========================================================================
+	# Name:       print_settings
+	# Purpose:    Prints current settings
+	# =========================================================================
+	def print_settings(self):
+		print ("{:<2}{:<25}".format('','======================================================================='))
+		print ("{:<2}{:<25}{:<10}".format('','Setting', 'Value'))
+		print ("{:<2}{:<25}".format('','======================================================================='))
+		print ("{:<2}{:<25}{:<10}".format('',"Session File", str(self.loaded_file)))
+		print ("{:<2}{:<25}{:<10}".format('',"Session Date&Time", str(self.session_datetime)))
+		print ("{:<2}{:<25}{:<10}".format('',"Session Loaded", str(self.loaded)))
+		print ("{:<2}{:<25}{:<10}".format('',"Target Path", str(self.target_path)))
+		print ("{:<2}{:<25}{:<10}".format('',"Recursive", str(self.recursive_search)))
+		print ("{:<2}{:<25}{:<10}".format('',"Hash Type", str(self.hasher.hash_type)))
+		print ("{:<2}{:<25}{:<10}".format('',"Verbose Progress", str(self.verbose_mode)))
+		print ("{:<2}{:<25}{:<10}".format('',"Hashing Workers", "{} ({})".format(self.hasher.workers, self.hasher.pool_type)))
+		print ("{:<2}{:<25}{:<10}".format('',"Device Workers", ", ".join("{}={}".format(device_path, path_workers)
+			for device_path, path_workers in self.hasher.device_workers.items()) or "None"))
+		print ("{:<2}{:<25}{:<10}".format('',"Read Engine", "{} ({})".format(self.hasher.io_mode, self.hasher.chunk_size or "adaptive")))
+		print ("{:<2}{:<25}{:<10}".format('',"Hash Cache", str(self.cache_mode)))
+		print ("{:<2}{:<25}{:<10}".format('',"Discovery Workers", str(self.discovery_workers)))
+		print ("{:<2}{:<25}{:<10}".format('',"Streaming", str(self.stream_mode)))
+		print ("{:<2}{:<25}{:<10}".format('',"List Format", str(self.list_format)))
+		print ("{:<2}{:<25}{:<10}".format('',"Metrics File", str(self.metrics_file)))
+		print ("{:<2}{:<25}{:<10}".format('',"Include Rules", ", ".join(self.include_rules) or "None"))
+		print ("{:<2}{:<25}{:<10}".format('',"Exclude Rules", ", ".join(self.exclude_rules) or "None"))
+		print ("{:<2}{:<25}{:<10}".format('',"File Size Range", "{}:{}".format(
+			"" if self.min_size is None else correct_file_size(self.min_size),
+			"" if self.max_size is None else correct_file_size(self.max_size))))
+		print ("{:<2}{:<25}{:<10}".format('',"One File System", str(self.one_file_system)))
+		print ("{:<2}{:<25}{:<10}".format('',"Max Depth", str(self.max_depth)))
+		print ("{:<2}{:<25}{:<10}".format('',"Follow Symlinks", str(self.follow_symlinks)))
+		print ("{:<2}{:<25}".format('','======================================================================='))
+	# =========================================================================
+	# =========================================================================
+	# Name:       add_metrics_hook(hook)
+	# Arguments:  hook = function called with a dict snapshot of the metrics
+	# Purpose:    Registers a function receiving metrics snapshots every
+	#             _metrics_interval seconds and at the end of every phase.
+	# =========================================================================
+	def add_metrics_hook(self, hook):
+		self._metrics_hooks.append(hook)
+	# =========================================================================
+	# Name:       remove_metrics_hook(hook)
+	# Arguments:  hook = function registered with add_metrics_hook()
+	# Purpose:    Stops sending metrics snapshots to the function.
+	# =========================================================================
+	def remove_metrics_hook(self, hook):
+		if hook in self._metrics_hooks:
+			self._metrics_hooks.remove(hook)
+	# =========================================================================
+	# Name:       metrics_add(**counters)
+	# Arguments:  counters = metrics names with values to add
+	# Purpose:    Adds values to metrics counters and timers
+	# =========================================================================
+	def metrics_add(self, **counters):
+		with self._metrics_lock:
+			for name, value in counters.items():
+				self._metrics[name] += value
+	# =========================================================================
+	# Name:       metrics_snapshot()
+	# Purpose:    Returns copy of the metrics with throughput, ETA and whether
+	#             hashing spends more time waiting on reads (io) or hashing (cpu).
+	#             Unknown (None) once a file was mapped, its reads can't be timed.
+	# =========================================================================
+	def metrics_snapshot(self):
+		with self._metrics_lock:
+			snapshot = collections.OrderedDict(self._metrics)
+		phase_seconds = monotonic() - snapshot.pop("phase_started")
+		snapshot["time"] = time()
+		snapshot["phase_seconds"] = round(phase_seconds, 3)
+		snapshot["files_per_s"] = round(snapshot["files_hashed"] / phase_seconds, 2) if phase_seconds > 0 else 0.0
+		snapshot["bytes_per_s"] = round(snapshot["bytes_hashed"] / phase_seconds, 2) if phase_seconds > 0 else 0.0
+
+		remaining_bytes = snapshot["bytes_discovered"] - snapshot["bytes_hashed"] - snapshot["bytes_cached"] - snapshot["bytes_linked"] - snapshot["bytes_resumed"]
+		if snapshot["bytes_per_s"] > 0 and not self._discovery_running:
+			snapshot["eta_seconds"] = round(max(remaining_bytes, 0) / snapshot["bytes_per_s"], 1)
+		else:
+			snapshot["eta_seconds"] = None
+		if snapshot["mapped_seconds"] > 0 or (snapshot["read_seconds"] == 0 and snapshot["hash_seconds"] == 0):
+			snapshot["bound"] = None
+		else:
+			snapshot["bound"] = "io" if snapshot["read_seconds"] > snapshot["hash_seconds"] else "cpu"
+		return snapshot
+	# =========================================================================
+	# Name:       metrics_emit(force)
+	# Arguments:  force = True to send a snapshot regardless of time
+	# Purpose:    Sends a snapshot to the metrics hooks every _metrics_interval.
+	# =========================================================================
+	def metrics_emit(self, force=False):
+		if not self._metrics_hooks or (not force and monotonic() - self._metrics_last_emit < _metrics_interval):
+			return
+		self._metrics_last_emit = monotonic()
+		snapshot = self.metrics_snapshot()
+		for hook in list(self._metrics_hooks):
+			hook(snapshot)
+	# =========================================================================
+	# Name:       metrics_phase(phase)
+	# Arguments:  phase = name of the phase that starts (discovery, hashing, ...)
+	# Purpose:    Sends a snapshot for the phase that ended and starts timing the
+	#             next one.
+	# =========================================================================
+	def metrics_phase(self, phase):
+		if self._metrics["phase"] != "idle":
+			self.metrics_emit(True)
+		with self._metrics_lock:
+			self._metrics["phase"] = phase
+			self._metrics["phase_started"] = monotonic()
+	# =========================================================================
+	# Name:       metrics_file_saving(snapshot)
+	# Arguments:  snapshot = metrics snapshot
+	# Purpose:    Metrics hook appending snapshots to the metrics file as JSON lines.
+	# =========================================================================
+	def metrics_file_saving(self, snapshot):
+		with open(self.metrics_file, 'a', encoding='utf8') as f:
+			f.write(json.dumps(snapshot) + "\n")
+	# =========================================================================
+	# Name:       csv_saving(csv_path, row_data)
+	# Arguments:  csv_path = path of the csv file the row is appended to
+	#             row_data = list of values for a single row
+	# Purpose:    Appends a row through a csv writer (or BinaryListWriter for
+	#             '.hpb' lists) that stays open for the session. Rows are flushed every _csv_flush_rows rows or
+	#             _csv_flush_seconds and synced to disk every _csv_fsync_seconds,
+	#             so a crash loses at most the rows since the last flush.
+	# =========================================================================
+	def csv_saving(self, csv_path, row_data):
+		csv_state = self._csv_writers.get(csv_path)
+		if csv_state is None:
+			# Create folder for current session
+			os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+			if is_binary_list(csv_path):
+				f = open(csv_path, 'ab', buffering=_csv_buffer_size)
+				writer = BinaryListWriter(f)
+			else:
+				f = open(csv_path, 'a', newline='', encoding='utf8', buffering=_csv_buffer_size) # newline='' removes blank lines between outputs that csv data tries to input?
+				writer = csv.writer(f)
+			csv_state = self._csv_writers[csv_path] = {
+				'file': f,
+				'writer': writer,
+				'pending_rows': 0,
+				'last_flush': monotonic(),
+				'last_fsync': monotonic(),
+			}
+		write_start = perf_counter()
+		csv_state['writer'].writerow(row_data)
+		csv_state['pending_rows'] += 1
+
+		if csv_state['pending_rows'] >= _csv_flush_rows or monotonic() - csv_state['last_flush'] >= _csv_flush_seconds:
+			self.csv_flushing(csv_state)
+		self.metrics_add(write_seconds=perf_counter() - write_start)
+	# =========================================================================
+	# Name:       csv_flushing(csv_state, force_fsync)
+	# Arguments:  csv_state = state of an open csv writer
+	#             force_fsync = True to sync to disk regardless of time
+	# Purpose:    Flushes pending rows and syncs them to disk at checkpoints.
+	# =========================================================================
+	def csv_flushing(self, csv_state, force_fsync=False):
+		f = csv_state['file']
+		# Binary lists keep rows until they are saved as a block
+		if isinstance(csv_state['writer'], BinaryListWriter):
+			csv_state['writer'].flush()
+		f.flush()
+		csv_state['pending_rows'] = 0
+		csv_state['last_flush'] = monotonic()
+		if force_fsync or csv_state['last_flush'] - csv_state['last_fsync'] >= _csv_fsync_seconds:
+			os.fsync(f.fileno())
+			csv_state['last_fsync'] = csv_state['last_flush']
+	# =========================================================================
+	# Name:       csv_closing(csv_path)
+	# Arguments:  csv_path = path of the csv file to close, None closes all
+	# Purpose:    Flushes, syncs and closes open csv writers.
+	# =========================================================================
+	def csv_closing(self, csv_path=None):
+		csv_paths = list(self._csv_writers) if csv_path is None else [csv_path]
+		for open_path in csv_paths:
+			csv_state = self._csv_writers.pop(open_path, None)
+			if csv_state is not None:
+				self.csv_flushing(csv_state, True)
+				csv_state['file'].close()
+	# =========================================================================
+	# Name:       file_discovery_saving())
+	# Purpose:    Saves list of discovered files to a file 'discovered_files.csv'
+	# =========================================================================
+	def file_discovery_saving(self, discovered_file_data):
+		# Inode after the saved columns is only kept in memory
+		self.csv_saving(self.discovered_list_path, discovered_file_data[:6])
+		self._discovered_files_count += 1
+		# Header row has no size
+		if self._discovered_files_count > 1:
+			self.metrics_add(files_discovered=1, bytes_discovered=int(discovered_file_data[2]))
+			self.metrics_emit()
+	# =========================================================================
+	# Name:       file_discovery_status(file_count)
+	# Purpose:    Displays formatted console output showing number of files discovered.
+	# =========================================================================
+	def file_discovery_status(self, list_end):
+		if self.verbose_mode:
+			# Console output is slow, only update it every _display_interval
+			if not list_end and monotonic() - self._last_display_time < _display_interval:
+				return
+			self._last_display_time = monotonic()
+			real__discovered_files_count = self._discovered_files_count - 1 # correction for the header row
+			if (list_end):
+				print ("{:<2}{:<25}{:<10}".format('',"Discovered files", str(real__discovered_files_count)))
+				for entry_type, label in _entry_type_labels:
+					if self._entry_counts[entry_type]:
+						print ("{:<2}{:<25}{:<10}".format('',label, str(self._entry_counts[entry_type])))
+				print ("{:<2}{:<25}".format('','======================================================================='))
+			else:
+				text = ("\r{:<2}{:<25}{:<10}".format('',"Discovered files", str(real__discovered_files_count)))
+				print (text,end='\r')
+	# =========================================================================
+	# Name:       file_discovery(file_callback, listed_files)
+	# Arguments:  file_callback = optional function called with every discovered
+	#             file info after it is saved, used when streaming to hashing
+	#             listed_files = optional set of (Location, Name) already saved
+	#             to the discovered list, these files are skipped
+	# Purpose:    Discovers files and directories based on provided path.
+	# =========================================================================
+	def file_discovery(self, file_callback=None, listed_files=None):
+		if not self._discovery_running:
+			self.metrics_phase("discovery")
+		# The general idea is to have a file discovery as before, but this time save all of the files and the information about them in csv format.
+		# Data that we are interested in mainly:
+		csv_format_header = ["Location", "Name", "Size","Created","Modified","Hash"]
+		if self._discovered_files_count == 0:
+			self.file_discovery_saving(csv_format_header) # Save first Row
+		# File Discovery Functions Here:
+		# If path is a single file
+		if (os.path.isfile(self.target_path)):
+			current_file_info = get_file_info(self.target_path)
+			# File could have been removed or replaced since validation
+			if current_file_info is not None and not (listed_files and tuple(current_file_info[:2]) in listed_files):
+				self.file_discovery_saving(current_file_info)
+				if file_callback is not None:
+					file_callback(current_file_info)
+				else:
+					self.file_discovery_status(False)
+		# If path is a directory
+		elif (os.path.isdir(self.target_path)):
+			for directory_files in self.walk_directories(self.target_path):
+				for current_file_info in directory_files:
+					if listed_files and tuple(current_file_info[:2]) in listed_files:
+						continue
+					self.file_discovery_saving(current_file_info)
+					if file_callback is not None:
+						file_callback(current_file_info)
+					else:
+						self.file_discovery_status(False)
+
+		# Discovered list is read back by file_hasher()
+		self.csv_closing(self.discovered_list_path)
+		self.file_discovery_status(True)
+	# =========================================================================
+	# Name:       get_discovery_filter(root_path)
+	# Arguments:  root_path = directory where file discovery starts
+	# Purpose:    Returns DiscoveryFilter of the session, None without filters
+	# =========================================================================
+	def get_discovery_filter(self, root_path):
+		if not (self.include_rules or self.exclude_rules or self.min_size is not None or self.max_size is not None
+				or self.one_file_system or self.max_depth is not None):
+			return None
+		return DiscoveryFilter(root_path, self.include_rules, self.exclude_rules, self.min_size, self.max_size,
+			self.one_file_system, self.max_depth)
+	# =========================================================================
+	# Name:       walk_directories(root_path, recursive, use_filters)
+	# Arguments:  root_path = directory where file discovery starts
+	#             recursive = scan sub directories, defaults to session setting
+	#             use_filters = apply the session discovery filters
+	# Purpose:    Yields list of file info for every scanned directory. Only the
+	#             root directory is scanned unless in recursive mode. With more
+	#             than one discovery worker directories are scanned in parallel,
+	#             with at most two directories per worker in flight.
+	# =========================================================================
+	def walk_directories(self, root_path, recursive=None, use_filters=True):
+		if recursive is None:
+			recursive = self.recursive_search
+		discovery_filter = self.get_discovery_filter(root_path) if use_filters else None
+		# Directories are kept with their depth below root_path
+		pending_dirs = collections.deque([(root_path, 0)])
+		# Followed directory links can lead back to a scanned directory
+		visited_dirs = None
+		if self.follow_symlinks == "all":
+			st = os.stat(root_path)
+			visited_dirs = {(st.st_dev, st.st_ino)}
+
+		if self.discovery_workers == 1:
+			while pending_dirs:
+				dir_path, depth = pending_dirs.popleft()
+				scan_result = scan_directory(dir_path, discovery_filter, depth, self.follow_symlinks)
+				yield self.scanned_directory(scan_result, depth, recursive, pending_dirs, visited_dirs)
+			return
+
+		max_in_flight = self.discovery_workers * 2
+		in_flight = {}
+		with ThreadPoolExecutor(max_workers=self.discovery_workers) as pool:
+			while pending_dirs or in_flight:
+				while pending_dirs and len(in_flight) < max_in_flight:
+					dir_path, depth = pending_dirs.popleft()
+					in_flight[pool.submit(scan_directory, dir_path, discovery_filter, depth, self.follow_symlinks)] = depth
+				done, not_done = wait(in_flight, return_when=FIRST_COMPLETED)
+				for future in done:
+					depth = in_flight.pop(future)
+					yield self.scanned_directory(future.result(), depth, recursive, pending_dirs, visited_dirs)
+	# =========================================================================
+	# Name:       scanned_directory(scan_result, depth, recursive, pending_dirs, visited_dirs)
+	# Arguments:  scan_result = result of scan_directory()
+	#             depth = directory levels of the scanned directory below root
+	#             recursive = queue sub directories for scanning
+	#             pending_dirs = deque of (directory, depth) to scan
+	#             visited_dirs = set of directory keys when following links
+	# Purpose:    Records counts and file links of a scanned directory, queues
+	#             its sub directories and returns its list of file info.
+	# =========================================================================
+	def scanned_directory(self, scan_result, depth, recursive, pending_dirs, visited_dirs):
+		directory_files, sub_dirs, stat_seconds, entry_counts, file_links = scan_result
+		self.metrics_add(stat_seconds=stat_seconds)
+		self._entry_counts.update(entry_counts)
+		for file_path, inode_key in file_links:
+			file_path = os.path.normpath(file_path)
+			if file_path not in self._link_paths:
+				self._link_paths[file_path] = inode_key
+				self._link_paths_left[inode_key] += 1
+		if recursive:
+			for sub_dir, dir_key in sub_dirs:
+				if dir_key is not None:
+					if dir_key in visited_dirs:
+						self._entry_counts["loop"] += 1
+						continue
+					visited_dirs.add(dir_key)
+				pending_dirs.append((sub_dir, depth + 1))
+		return directory_files
+	# =========================================================================
+	# Name:       get_hashing_status(file_path, list_end)
+	# Purpose:    Displays formatted console output showing hashing progress in
+	#             verbose mode.
+	# =========================================================================
+	def display_hashing_status(self, hashing_file_data, list_end):
+		if not self.verbose_mode:
+			return
+		# Console output is slow, only update it every _display_interval
+		if not list_end and monotonic() - self._last_display_time < _display_interval:
+			return
+		self._last_display_time = monotonic()
+
+		file_name = hashing_file_data[1]
+		file_size = correct_file_size(int(hashing_file_data[2]))
+		# Shortens the name to 40 characters
+		file_name = file_name[:40]
+
+		snapshot = self.metrics_snapshot()
+		file_rate = correct_file_size(snapshot["bytes_per_s"]) + "/s"
+		file_eta = "--:--:--" if snapshot["eta_seconds"] is None else strftime("%H:%M:%S", gmtime(snapshot["eta_seconds"]))
+
+		if(list_end):
+			print("{:<2}{:<8}{:<5}{:<1}{:<8}{:<6}{:<10}{:<6}{:<12}{:<5}{:<10}{:<6}{:<10}".format('',"Hashing",self._hashed_files_count,"/",self._discovered_files_count-1, "Size:", file_size,"Rate:", file_rate,"ETA:", file_eta,"Name: ",str(file_name)))
+			print("{:<2}{:<25}".format('','======================================================================='))
+		else:
+			# Add +1 if this doesn't work correctly
+			text = ("\r{:<2}{:<8}{:<5}{:<1}{:<8}{:<6}{:<10}{:<6}{:<12}{:<5}{:<10}{:<6}{:<10}".format('',"Hashing",self._hashed_files_count,"/",self._discovered_files_count-1, "Size:", file_size,"Rate:", file_rate,"ETA:", file_eta,"Name: ",str(file_name)))
+			# If previous entry was longer, clear the entry
+			if (self._last_output_length > len(text)):
+				print(" "*self._last_output_length,end='\r')
+			# Display current entry
+			print (text,end='\r')
+			# Update last entry length
+			self._last_output_length = len(text)
+	# =========================================================================
+	# Name:       file_hashed_saving()
+	# Purpose:    Saves list of hashed files to a file 'hashed_files.csv'
+	# =========================================================================
+	def file_hashed_saving(self, hashed_file_data):
+		self.csv_saving(self.hashed_list_path, hashed_file_data)
+		self._hashed_files_count += 1
+	# =========================================================================
+	# Name:       open_hash_cache()
+	# Purpose:    Returns connection to the hash cache or None if cache is off
+	#             or can't be opened, files are hashed without it then.
+	# =========================================================================
+	def open_hash_cache(self):
+		if self.cache_mode == "off":
+			return None
+		os.makedirs(os.path.dirname(self.cache_file_path), exist_ok=True)
+		try:
+			# Other sessions may hold the write lock, wait for their commit
+			cache = sqlite3.connect(self.cache_file_path, timeout=_cache_busy_timeout)
+			cache.execute("PRAGMA journal_mode=WAL")
+			cache.execute("PRAGMA synchronous=NORMAL")
+			cache.execute("""CREATE TABLE IF NOT EXISTS hashes (
+				path TEXT NOT NULL,
+				algorithm TEXT NOT NULL,
+				inode INTEGER NOT NULL,
+				size INTEGER NOT NULL,
+				mtime_ns INTEGER NOT NULL,
+				digest TEXT NOT NULL,
+				PRIMARY KEY (path, algorithm))""")
+		except sqlite3.OperationalError as error:
+			self.hash_cache_failed(None, error)
+			return None
+		self._cache_uncommitted = 0
+		return cache
+	# =========================================================================
+	# Name:       hash_cache_failed(cache, error)
+	# Arguments:  cache = hash cache connection or None
+	#             error = sqlite3.OperationalError raised by the cache
+	# Purpose:    Drops uncommitted cache rows after an error, e.g. the cache
+	#             stayed locked by another session. Hashing goes on without them.
+	# =========================================================================
+	def hash_cache_failed(self, cache, error):
+		self._cache_stats["errors"] += 1
+		self._cache_uncommitted = 0
+		if cache is not None:
+			try:
+				cache.rollback()
+			except sqlite3.Error:
 				pass
-			#current_csv_position += 1
+		if self.verbose_mode:
+			print("\n{:<2}{:<25}{:<10}".format('',"Cache error", str(error)))
+	# =========================================================================
+	# Name:       commit_hash_cache(cache, force)
+	# Arguments:  cache = hash cache connection or None
+	#             force = True to commit regardless of rows and time
+	# Purpose:    Commits stored hashes every _cache_commit_interval rows or
+	#             _cache_commit_seconds, so the write lock of the cache shared
+	#             with other sessions is never held for long.
+	# =========================================================================
+	def commit_hash_cache(self, cache, force=False):
+		if cache is None or self._cache_uncommitted == 0:
+			return
+		if not force and self._cache_uncommitted < _cache_commit_interval and monotonic() - self._cache_last_commit < _cache_commit_seconds:
+			return
+		try:
+			cache.commit()
+		except sqlite3.OperationalError as error:
+			self.hash_cache_failed(cache, error)
+		self._cache_uncommitted = 0
+		self._cache_last_commit = monotonic()
+	# =========================================================================
+	# Name:       lookup_cached_hashes(cache, file_path)
+	# Arguments:  cache = hash cache connection or None
+	#             file_path = full path of the file that is about to be hashed
+	# Purpose:    Returns (cache_key, cached_hashes). cache_key identifies the
+	#             current state of the file, cached_hashes is a list with one
+	#             digest per session hash type or None when not all are cached.
+	# =========================================================================
+	def lookup_cached_hashes(self, cache, file_path):
+		if cache is None:
+			return None, None
+		try:
+			st = os.stat(file_path)
+		except OSError:
+			return None, None
+		cache_key = (file_path, st.st_ino, st.st_size, st.st_mtime_ns)
+
+		cached_hashes = []
+		for hash_type in self.hasher.hash_types:
+			try:
+				cached_row = cache.execute(
+					"SELECT digest FROM hashes WHERE path=? AND algorithm=? AND inode=? AND size=? AND mtime_ns=?",
+					(file_path, hash_type, st.st_ino, st.st_size, st.st_mtime_ns)).fetchone()
+			except sqlite3.OperationalError as error:
+				# File is hashed instead
+				self.hash_cache_failed(cache, error)
+				cached_row = None
+			if cached_row is None:
+				self._cache_stats["misses"] += 1
+				return cache_key, None
+			cached_hashes.append(cached_row[0])
+
+		self._cache_stats["hits"] += 1
+		if self.cache_mode == "trust":
+			self._cache_stats["bytes_skipped"] += st.st_size
+		return cache_key, cached_hashes
+	# =========================================================================
+	# Name:       store_cached_hashes(cache, cache_key, cached_hashes, file_hashes)
+	# Arguments:  cache = hash cache connection or None
+	#             cache_key, cached_hashes = values from lookup_cached_hashes()
+	#             file_hashes = list of digests that were just calculated
+	# Purpose:    Checks calculated hashes against the cache and saves new ones.
+	# =========================================================================
+	def store_cached_hashes(self, cache, cache_key, cached_hashes, file_hashes):
+		if cache is None or cache_key is None or cached_hashes == file_hashes:
+			return
+		# Dummy hash values mean file couldn't be read
+		if any(file_hash.startswith("-") for file_hash in file_hashes):
+			return
+		if cached_hashes is not None:
+			self._cache_stats["mismatches"] += 1
+			if self.verbose_mode:
+				print("\n{:<2}{:<25}{:<10}".format('',"Cache mismatch", cache_key[0]))
+
+		file_path, inode, size, mtime_ns = cache_key
+		try:
+			cache.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+				[(file_path, hash_type, inode, size, mtime_ns, file_hash)
+				for hash_type, file_hash in zip(self.hasher.hash_types, file_hashes)])
+		except sqlite3.OperationalError as error:
+			self.hash_cache_failed(cache, error)
+			return
+		if self._cache_uncommitted == 0:
+			self._cache_last_commit = monotonic()
+		self._cache_uncommitted += 1
+		self.commit_hash_cache(cache)
+	# =========================================================================
+	# Name:       display_cache_status()
+	# Purpose:    Displays formatted console output with hash cache statistics.
+	# =========================================================================
+	def display_cache_status(self):
+		looked_up = self._cache_stats["hits"] + self._cache_stats["misses"]
+		hit_ratio = (100.0 * self._cache_stats["hits"] / looked_up) if looked_up else 0.0
+		print ("{:<2}{:<25}{:<10}".format('',"Cache hits", "{} / {} ({:.1f}%)".format(self._cache_stats["hits"], looked_up, hit_ratio)))
+		if self.cache_mode == "trust":
+			print ("{:<2}{:<25}{:<10}".format('',"Cache bytes skipped", correct_file_size(self._cache_stats["bytes_skipped"])))
+		else:
+			print ("{:<2}{:<25}{:<10}".format('',"Cache mismatches", str(self._cache_stats["mismatches"])))
+		if self._cache_stats["errors"]:
+			print ("{:<2}{:<25}{:<10}".format('',"Cache errors", str(self._cache_stats["errors"])))
+		print ("{:<2}{:<25}".format('','======================================================================='))
+	# =========================================================================
+	# Name:       plan_hash_rows(rows, cache)
+	# Arguments:  rows = iterable of discovered rows (dicts) that need hashing,
+	#             a None row means the source has nothing ready yet
+	#             cache = hash cache connection or None
+	# Purpose:    Yields (job type, items) in input order, items is a list of
+	#             (row, cache_key, cached_hashes). Job types are:
+	#               - "cached" for a file taken from the cache
+	#               - "linked" for a file linked to an inode discovered earlier
+	#               - "small" for a batch of files up to _fast_path_limit, picked
+	#                 from the Size recorded at discovery
+	#               - "file" for a single larger file
+	#               - "idle" without items for a None row, after the files
+	#                 batched so far, so they aren't held until more arrive
+	# =========================================================================
+	def plan_hash_rows(self, rows, cache=None):
+		small_batch = []
+		for row in rows:
+			if row is None:
+				if small_batch:
+					yield "small", small_batch
+					small_batch = []
+				yield "idle", []
+				continue
+			file_path = os.path.join(row['Location'],row['Name'])
+			inode_key = self._link_paths.get(os.path.normpath(file_path)) if self._link_paths else None
+			if inode_key is not None:
+				if inode_key in self._link_planned:
+					# Inode is read once, through the first of its paths planned
+					if small_batch:
+						yield "small", small_batch
+						small_batch = []
+					yield "linked", [(row, None, None)]
+					continue
+				self._link_planned.add(inode_key)
+			cache_key, cached_hashes = self.lookup_cached_hashes(cache, file_path)
+			item = (row, cache_key, cached_hashes)
+			if int(row['Size']) <= _fast_path_limit and not (cached_hashes is not None and self.cache_mode == "trust"):
+				small_batch.append(item)
+				if len(small_batch) >= _fast_path_batch_files:
+					yield "small", small_batch
+					small_batch = []
+				continue
+			# Keep the order, files batched so far go first
+			if small_batch:
+				yield "small", small_batch
+				small_batch = []
+			if cached_hashes is not None and self.cache_mode == "trust":
+				yield "cached", [item]
+			else:
+				yield "file", [item]
+		if small_batch:
+			yield "small", small_batch
+	# =========================================================================
+	# Name:       finish_hash_job(cache, job_type, items, result)
+	# Arguments:  cache = hash cache connection or None
+	#             job_type, items = job from plan_hash_rows()
+	#             result = result of the hashing job, None for cached and
+	#             linked files
+	# Purpose:    Adds the job to the metrics and yields (row, hash, timings)
+	#             of each row of the job. Hashes of linked inodes are kept for
+	#             their other paths.
+	# =========================================================================
+	def finish_hash_job(self, cache, job_type, items, result):
+		if job_type == "cached":
+			row, cache_key, cached_hashes = items[0]
+			self.metrics_add(files_cached=1, bytes_cached=int(row['Size']))
+			self.keep_link_hashes(row, cached_hashes)
+			yield row, cached_hashes, None
+			return
+		if job_type == "linked":
+			row = items[0][0]
+			file_path = os.path.join(row['Location'],row['Name'])
+			linked_hashes = self._link_hashes.get(self._link_paths[os.path.normpath(file_path)])
+			if linked_hashes is not None:
+				self.metrics_add(files_linked=1, bytes_linked=int(row['Size']))
+				self.keep_link_hashes(row, linked_hashes)
+				yield row, linked_hashes, None
+				return
+			# First path wasn't hashed in this session, read this one
+			result = self.hasher.hash_file_timed(file_path)
+		if job_type == "small":
+			file_hashes, file_timings = result
+		else:
+			file_hashes, file_timings = [result[0]], [result[1]]
+		for (row, cache_key, cached_hashes), hashes, timings in zip(items, file_hashes, file_timings):
+			self.metrics_add(files_hashed=1, bytes_hashed=int(row['Size']), **timings)
+			self.store_cached_hashes(cache, cache_key, cached_hashes, hashes)
+			self.keep_link_hashes(row, hashes)
+			yield row, hashes, timings
+	# =========================================================================
+	# Name:       keep_link_hashes(row, file_hashes)
+	# Arguments:  row = hashed row (dict)
+	#             file_hashes = list of digests of the row
+	# Purpose:    Keeps hashes of a file with several links for its other paths.
+	#             Inode is forgotten once all of its discovered paths are hashed,
+	#             so trees with many hardlinks don't fill the memory.
+	# =========================================================================
+	def keep_link_hashes(self, row, file_hashes):
+		if self._link_paths:
+			inode_key = self._link_paths.pop(os.path.normpath(os.path.join(row['Location'],row['Name'])), None)
+			if inode_key is not None:
+				self._link_hashes.setdefault(inode_key, file_hashes)
+				self._link_paths_left[inode_key] -= 1
+				if self._link_paths_left[inode_key] <= 0:
+					del self._link_paths_left[inode_key]
+					self._link_hashes.pop(inode_key, None)
+					self._link_planned.discard(inode_key)
+	# =========================================================================
+	# Name:       get_location_device(location)
+	# Arguments:  location = directory of a discovered file
+	# Purpose:    Returns st_dev of the directory, None if it can't be read.
+	#             Files are on the device of their directory, so it takes one
+	#             stat per directory.
+	# =========================================================================
+	def get_location_device(self, location):
+		device = self._location_devices.get(location, False)
+		if device is False:
+			try:
+				device = os.stat(location).st_dev
+			except OSError:
+				device = None
+			self._location_devices[location] = device
+		return device
+	# =========================================================================
+	# Name:       parallel_hash_rows(rows, cache)
+	# Arguments:  rows = iterable of discovered rows (dicts) that need hashing
+	#             cache = hash cache connection or None
+	# Purpose:    Hashes rows on the device pools of the hasher and yields
+	#             (row, hash, timings) in input order. Jobs are queued by the
+	#             device of their directory and every device runs up to its own
+	#             number of workers, taking its queued jobs in
+	#             get_read_order_key() order. Rows are read ahead while any
+	#             device is short of queued jobs, up to _scheduler_read_ahead
+	#             rows, so a slow device doesn't leave the others idle and very
+	#             large discovered lists are never loaded into memory at once.
+	#             Queued jobs are started and finished jobs saved before more
+	#             rows are read, and reading stops while the source has nothing
+	#             ready, so streamed files are hashed as soon as they arrive.
+	#             Hash is a list with one digest per session hash type,
+	#             timings is None for files taken from the cache or a link.
+	# =========================================================================
+	def parallel_hash_rows(self, rows, cache=None):
+		jobs = self.plan_hash_rows(rows, cache)
+		jobs_left = True
+		pending = collections.deque()				# [job type, items, future] in input order
+		pending_rows = 0
+		device_queues = {}							# device: heap of (read order key, number, job)
+		device_running = collections.Counter()
+		running = {}								# future: device
+		job_numbers = itertools.count()
+
+		while jobs_left or pending:
+			# Free workers of finished jobs and start queued jobs
+			for future in [future for future in running if future.done()]:
+				device_running[running.pop(future)] -= 1
+			for device, device_queue in device_queues.items():
+				while device_queue and device_running[device] < self.hasher.get_device_workers(device):
+					job = heapq.heappop(device_queue)[2]
+					job_type, items = job[0], job[1]
+					if job_type == "small":
+						job[2] = self.hasher.submit_small([os.path.join(row['Location'],row['Name']) for row, _, _ in items],
+							[int(row['Size']) for row, _, _ in items], device, get_row_inodes(items))
+					else:
+						job[2] = self.hasher.submit(os.path.join(items[0][0]['Location'],items[0][0]['Name']), device)
+					device_running[device] += 1
+					running[job[2]] = device
+
+			# Save finished jobs in input order before reading more rows
+			while pending and pending[0][2] is not None and pending[0][2].done():
+				job_type, items, future = pending.popleft()
+				pending_rows -= len(items)
+				yield from self.finish_hash_job(cache, job_type, items, future.result())
+
+			# Read ahead until every device has enough queued jobs
+			jobs_added = 0
+			source_idle = False
+			while jobs_left and pending_rows < _scheduler_read_ahead and (not pending or any(
+					len(device_queue) < self.hasher.get_device_workers(device) * _scheduler_queue_depth
+					for device, device_queue in device_queues.items())):
+				job = next(jobs, None)
+				if job is None:
+					jobs_left = False
+					break
+				if job[0] == "idle":
+					# Source has nothing ready, go on with the queued jobs
+					source_idle = True
+					break
+				job = [job[0], job[1], None]
+				pending.append(job)
+				pending_rows += len(job[1])
+				jobs_added += 1
+				if job[0] in ("cached", "linked"):
+					# File is not opened, it only keeps its place in the order
+					job[2] = Future()
+					job[2].set_result(None)
+				else:
+					first_row = job[1][0][0]
+					device = self.get_location_device(first_row['Location'])
+					order_key = get_read_order_key(first_row['Location'], first_row.get('Inode'))
+					heapq.heappush(device_queues.setdefault(device, []), (order_key, next(job_numbers), job))
+					if device_running[device] < self.hasher.get_device_workers(device):
+						# A worker of the device is free, start the job first
+						break
+
+			# Wait for a worker unless new jobs can be started, only briefly
+			# while the source may have more rows soon
+			if running and not jobs_added:
+				wait(running, timeout=_stream_poll_interval if source_idle else None, return_when=FIRST_COMPLETED)
+	# =========================================================================
+	# Name:       serial_hash_rows(rows, cache)
+	# Arguments:  rows = iterable of discovered rows (dicts) that need hashing
+	#             cache = hash cache connection or None
+	# Purpose:    Hashes rows one job at a time and yields (row, hash, timings)
+	#             in input order.
+	# =========================================================================
+	def serial_hash_rows(self, rows, cache=None):
+		for job_type, items in self.plan_hash_rows(rows, cache):
+			if job_type == "idle":
+				continue
+			if job_type == "small":
+				result = self.hasher.hash_small_files_timed([os.path.join(row['Location'],row['Name']) for row, _, _ in items],
+					[int(row['Size']) for row, _, _ in items], get_row_inodes(items))
+				# Batch is hashed quickly, status is displayed as rows are saved
+				for row, file_hashes, timings in self.finish_hash_job(cache, job_type, items, result):
+					end_of_file = (self._hashed_files_count + 1 == self._discovered_files_count) and not self._discovery_running
+					self.display_hashing_status([row['Location'],row['Name'],row['Size'],row['Created'],row['Modified']] + file_hashes, end_of_file)
+					yield row, file_hashes, timings
+				continue
+			row = items[0][0]
+			# Print  Hashing Status - important to display hashing before file is actually hashed
+			end_of_file = (self._hashed_files_count + 1 == self._discovered_files_count) and not self._discovery_running
+			self.display_hashing_status([row['Location'],row['Name'],row['Size'],row['Created'],row['Modified'],""], end_of_file)
+			result = None
+			if job_type == "file":
+				result = self.hasher.hash_file_timed(os.path.join(row['Location'],row['Name']))
+			yield from self.finish_hash_job(cache, job_type, items, result)
+	# =========================================================================
+	# Name:       load_discovery_progress()
+	# Purpose:    Restores discovered files count from 'discovered_files.csv'
+	#             instead of discovering the files again.
+	# =========================================================================
+	def load_discovery_progress(self):
+		# Count includes the header row, same as file_discovery_saving()
+		self._discovered_files_count, discovered_bytes, last_discovered_file = count_list_rows(self.discovered_list_path)
+		self.metrics_add(files_discovered=self._discovered_files_count - 1, bytes_discovered=discovered_bytes)
+		self.file_discovery_status(True)
+	# =========================================================================
+	# Name:       resume_file_discovery()
+	# Purpose:    Completes discovery of a streamed session stopped before its
+	#             discovered list was complete. Files not listed yet are added
+	#             to the list, then settings are saved with discovery complete.
+	# =========================================================================
+	def resume_file_discovery(self):
+		listed_files = set()
+		if os.path.isfile(self.discovered_list_path):
+			repair_list_tail(self.discovered_list_path)
+			# Count includes the header row, same as file_discovery_saving()
+			self._discovered_files_count, discovered_bytes, last_discovered_file = count_list_rows(self.discovered_list_path)
+			self.metrics_add(files_discovered=max(self._discovered_files_count - 1, 0), bytes_discovered=discovered_bytes)
+			listed_files = set((location, name) for location, name, size in read_list_files(self.discovered_list_path))
+		if self.verbose_mode and self._discovered_files_count > 1:
+			print ("{:<2}{:<25}{:<10}".format('',"Resumed discovery after", str(self._discovered_files_count - 1)))
+		self.file_discovery(listed_files=listed_files)
+		self.save_settings()
+	# =========================================================================
+	# Name:       load_hashing_progress()
+	# Purpose:    Restores hashed files count from 'hashed_files.csv' of a loaded
+	#             session. Returns (discovered_rows, completed_files): reader of
+	#             'discovered_files.csv' positioned after the last hashed file
+	#             and a set of (Location, Name) already hashed or None if not
+	#             needed.
+	# =========================================================================
+	def load_hashing_progress(self):
+		repair_list_tail(self.hashed_list_path)
+		self._hashed_files_count, hashed_bytes, last_hashed_file = count_list_rows(self.hashed_list_path)
+		# Resumed bytes are left out of throughput but count towards the ETA
+		self.metrics_add(bytes_resumed=hashed_bytes)
+		# Files are hashed in discovery order so already hashed rows come first
+		resume_rows = max(self._hashed_files_count - 1, 0)
+		if resume_rows == 0:
+			return read_list_dicts(self.discovered_list_path), None
+
+		discovered_rows = read_list_dicts(self.discovered_list_path, resume_rows - 1)
+		discovered_row = next(discovered_rows, None)
+		if discovered_row is not None and [discovered_row['Location'], discovered_row['Name']] == last_hashed_file:
+			# Hashing continues from the same reader, no rows are read twice
+			return discovered_rows, None
+		discovered_rows.close()
+
+		# Order doesn't match (e.g. list edited by hand), fall back to full set
+		reader = read_list(self.hashed_list_path)
+		next(reader, None) # Skip header row
+		completed_files = set((hashed_row[0], hashed_row[1]) for hashed_row in reader)
+		return read_list_dicts(self.discovered_list_path), completed_files
+	# =========================================================================
+	# Name:       file_hasher(discovered_rows)
+	# Arguments:  discovered_rows = optional iterable of discovered rows (dicts),
+	#             read from 'discovered_files.csv' when not provided
+	# Purpose:    Hashes all discovered files
+	# =========================================================================
+	def file_hasher(self, discovered_rows=None):
+		if not self._discovery_running:
+			self.metrics_phase("hashing")
+
+		completed_files = None
+		if discovered_rows is None and self.loaded and os.path.isfile(self.hashed_list_path) and os.path.getsize(self.hashed_list_path) > 0:
+			# Header row is already saved, continue after the last hashed file
+			discovered_rows, completed_files = self.load_hashing_progress()
+		if self._hashed_files_count == 0:
+			#Here Save first row with headers
+			csv_format_header = ["Location", "Name", "Size","Created","Modified"] + get_hash_columns(self.hasher.hash_type)
+			self.file_hashed_saving(csv_format_header)
+		elif self.verbose_mode:
+			print ("{:<2}{:<25}{:<10}".format('',"Resumed after files", str(self._hashed_files_count - 1)))
+			print ("{:<2}{:<25}".format('','======================================================================='))
+
+		if discovered_rows is None:
+			discovered_rows = read_list_dicts(self.discovered_list_path)
+		try:
+			reader = discovered_rows
+			if completed_files is not None:
+				reader = (row for row in reader if row is None or (row['Location'], row['Name']) not in completed_files)
+			# If hash value is empty then proceed with hashing, None rows are passed on
+			pending_rows = (row for row in reader if row is None or row['Hash'] == "")
+
+			cache = self.open_hash_cache()
+
+			# Device pools are used with several workers or a device limit
+			parallel = self.hasher.workers > 1 or bool(self.hasher.device_workers)
+			if parallel:
+				hashed_rows = self.parallel_hash_rows(pending_rows, cache)
+			else:
+				hashed_rows = self.serial_hash_rows(pending_rows, cache)
+
+			for row, file_hashes, timings in hashed_rows:
+				self.metrics_emit()
+				self.commit_hash_cache(cache)
+				# Update current_file_info
+				hashed_file_data = [row['Location'],row['Name'],row['Size'],row['Created'],row['Modified']] + file_hashes
+				if parallel:
+					# Workers finish out of sight, so display status once saved in order
+					end_of_file = (self._hashed_files_count + 1 == self._discovered_files_count) and not self._discovery_running
+					self.display_hashing_status(hashed_file_data, end_of_file)
+				self.file_hashed_saving(hashed_file_data)
+
+			self.csv_closing(self.hashed_list_path)
+			if self.verbose_mode and self._metrics["files_linked"]:
+				print ("{:<2}{:<25}{:<10}".format('',"Linked files not read", str(self._metrics["files_linked"])))
+				print ("{:<2}{:<25}".format('','======================================================================='))
+			if cache is not None:
+				self.commit_hash_cache(cache, True)
+				cache.close()
+				if self.verbose_mode:
+					self.display_cache_status()
+		finally:
+			if hasattr(discovered_rows, 'close'):
+				discovered_rows.close()
+		self.metrics_phase("done")
+	# =========================================================================
+	# Name:       stream_discovery_rows(file_queue)
+	# Arguments:  file_queue = queue filled with file info by discovery thread
+	# Purpose:    Yields discovered rows (dicts) from the queue until discovery
+	#             puts None at the end of the list. Yields None whenever the
+	#             queue is empty, then waits up to _stream_poll_interval for
+	#             discovery, so hashing can go on with the files it already has.
+	#             Rows keep the Inode found by discovery to order the reads.
+	# =========================================================================
+	def stream_discovery_rows(self, file_queue):
+		csv_format_header = ["Location", "Name", "Size","Created","Modified","Hash","Inode"]
+		while True:
+			try:
+				current_file_info = file_queue.get_nowait()
+			except queue.Empty:
+				yield None
+				try:
+					current_file_info = file_queue.get(timeout=_stream_poll_interval)
+				except queue.Empty:
+					continue
+			if current_file_info is None:
+				return
+			row = dict(zip(csv_format_header, current_file_info))
+			row['Hash'] = ""
+			yield row
+	# =========================================================================
+	# Name:       stream_file_discovery(file_queue, discovery_errors)
+	# Arguments:  file_queue = bounded queue passed to hashing
+	#             discovery_errors = list collecting an exception from the thread
+	# Purpose:    Runs file discovery on its own thread, saves settings once the
+	#             discovered list is complete and marks the end of the queue.
+	# =========================================================================
+	def stream_file_discovery(self, file_queue, discovery_errors):
+		try:
+			self.file_discovery(file_queue.put)
+			self.save_settings()
+		except BaseException as error:
+			discovery_errors.append(error)
+		finally:
+			self._discovery_running = False
+			file_queue.put(None)
+	# =========================================================================
+	# Name:       stream_file_hasher()
+	# Purpose:    Hashes files while they are discovered. Discovery is the producer
+	#             and fills a bounded queue, hashing consumes it straight away.
+	# =========================================================================
+	def stream_file_hasher(self):
+		file_queue = queue.Queue(maxsize=_stream_queue_size)
+		discovery_errors = []
+		self.metrics_phase("streaming")
+		self._discovery_running = True
+		discovery_thread = threading.Thread(target=self.stream_file_discovery, args=(file_queue, discovery_errors), daemon=True)
+		discovery_thread.start()
+		self.file_hasher(self.stream_discovery_rows(file_queue))
+		discovery_thread.join()
+		if discovery_errors:
+			raise discovery_errors[0]
 
+	# =========================================================================
+	# Name:       group_by_hash(partial, inode_paths, file_size)
+	# Arguments:  partial = True to hash head and tail, False to hash whole files
+	#             inode_paths = dict of (device, inode) to list of paths
+	#             file_size = size shared by all the files
+	# Purpose:    Returns dict of hash to inode_paths dict, hashing one path per
+	#             inode and dropping files that can't be read.
+	# =========================================================================
+	def group_by_hash(self, partial, inode_paths, file_size):
+		inodes = list(inode_paths)
+		file_paths = [inode_paths[inode][0] for inode in inodes]
+		if partial:
+			file_hashes = self.hasher.map_partial(file_paths, file_size)
+			bytes_read = min(file_size, _partial_hash_size * 2)
+		else:
+			file_hashes = self.hasher.map_full(file_paths)
+			bytes_read = file_size
+
+		hash_groups = collections.defaultdict(dict)
+		for inode, file_hash in zip(inodes, file_hashes):
+			if file_hash is not None:
+				self._dedupe_stats["bytes_read"] += bytes_read
+				hash_groups[file_hash][inode] = inode_paths[inode]
+		return hash_groups
+	# =========================================================================
+	# Name:       load_size_groups()
+	# Purpose:    Returns dict of size to list of (Location, Name) for sizes shared
+	#             by more than one file. Discovered list is read twice so unique
+	#             sizes never have their paths kept in memory.
+	# =========================================================================
+	def load_size_groups(self):
+		size_counts = collections.Counter()
+		for location, name, file_size in read_list_files(self.discovered_list_path):
+			size_counts[file_size] += 1
+			self._dedupe_stats["files"] += 1
+			self._dedupe_stats["bytes_total"] += file_size
+
+		size_groups = collections.defaultdict(list)
+		for location, name, file_size in read_list_files(self.discovered_list_path):
+			# Empty files are all the same and there is nothing to reclaim
+			if file_size > 0 and size_counts[file_size] > 1:
+				size_groups[file_size].append((location, name))
+		return size_groups
+	# =========================================================================
+	# Name:       find_duplicates()
+	# Purpose:    Finds groups of duplicate files in the discovered list and saves
+	#             them to 'duplicates.csv'. Files are narrowed down by size, then
+	#             by partial hash, and only files that still match are hashed in
+	#             full. Hardlinks share one inode so each inode is read once.
+	# =========================================================================
+	def find_duplicates(self):
+		size_groups = self.load_size_groups()
+
+		csv_format_header = ["Group", "Hash", "Size", "Location", "Name"]
+		# Dedupe of a loaded session replaces the report of the last one
+		if os.path.isfile(self.duplicates_list_path):
+			os.remove(self.duplicates_list_path)
+		self.csv_saving(self.duplicates_list_path, csv_format_header)
+
+		try:
+			# Largest files first as they have the most bytes to reclaim
+			for file_size in sorted(size_groups, reverse=True):
+				inode_paths = collections.OrderedDict()
+				for location, name in size_groups[file_size]:
+					file_path = os.path.join(location, name)
+					try:
+						st = os.stat(file_path)
+					except OSError:
+						continue
+					inode_paths.setdefault((st.st_dev, st.st_ino), []).append(file_path)
+				# All paths are hardlinks to the same data
+				if len(inode_paths) < 2:
+					continue
+
+				for partial_hash, partial_group in self.group_by_hash(True, inode_paths, file_size).items():
+					if len(partial_group) < 2:
+						continue
+					if file_size <= _partial_hash_size * 2:
+						# Partial hash already covered the whole file
+						full_groups = {partial_hash: partial_group}
+					else:
+						full_groups = self.group_by_hash(False, partial_group, file_size)
+
+					for full_hash, duplicate_group in full_groups.items():
+						if len(duplicate_group) < 2:
+							continue
+						self.duplicates_saving(full_hash, file_size, duplicate_group)
+		finally:
+			self.csv_closing(self.duplicates_list_path)
+		self.display_duplicates_status()
+	# =========================================================================
+	# Name:       duplicates_saving(full_hash, file_size, duplicate_group)
+	# Arguments:  full_hash = hash shared by the group
+	#             file_size = size shared by the group
+	#             duplicate_group = dict of (device, inode) to list of paths
+	# Purpose:    Saves a group of duplicate files to 'duplicates.csv'
+	# =========================================================================
+	def duplicates_saving(self, full_hash, file_size, duplicate_group):
+		self._dedupe_stats["groups"] += 1
+		# Every inode but one could be reclaimed, hardlinks share their inode
+		self._dedupe_stats["duplicates"] += len(duplicate_group) - 1
+		self._dedupe_stats["reclaimable"] += (len(duplicate_group) - 1) * file_size
+		for paths in duplicate_group.values():
+			for file_path in paths:
+				location, name = os.path.split(file_path)
+				self.csv_saving(self.duplicates_list_path, [self._dedupe_stats["groups"], full_hash, file_size, location, name])
+	# =========================================================================
+	# Name:       display_duplicates_status()
+	# Purpose:    Displays formatted console output with duplicate statistics.
+	# =========================================================================
+	def display_duplicates_status(self):
+		bytes_total = self._dedupe_stats["bytes_total"]
+		read_ratio = (100.0 * self._dedupe_stats["bytes_read"] / bytes_total) if bytes_total else 0.0
+		print ("{:<2}{:<25}{:<10}".format('',"Files checked", str(self._dedupe_stats["files"])))
+		print ("{:<2}{:<25}{:<10}".format('',"Duplicate groups", str(self._dedupe_stats["groups"])))
+		print ("{:<2}{:<25}{:<10}".format('',"Duplicate files", str(self._dedupe_stats["duplicates"])))
+		print ("{:<2}{:<25}{:<10}".format('',"Reclaimable", correct_file_size(self._dedupe_stats["reclaimable"])))
+		print ("{:<2}{:<25}{:<10}".format('',"Bytes read", "{} of {} ({:.1f}%)".format(correct_file_size(self._dedupe_stats["bytes_read"]), correct_file_size(bytes_total), read_ratio)))
+		print ("{:<2}{:<25}{:<10}".format('',"Duplicates list", self.duplicates_list_path))
+		print ("{:<2}{:<25}".format('','======================================================================='))
+	# =========================================================================
+	# Name:       open_index()
+	# Purpose:    Returns connection to the index of this session, see
+	#             open_session_index().
+	# =========================================================================
+	def open_index(self):
+		return open_session_index(self.config_file_path)
+	# =========================================================================
+	# Name:       run_queries(query_path_value, query_hash_value, query_size_value, output)
+	# Arguments:  query_path_value = full path of a file, or None
+	#             query_hash_value = hex digest, or None
+	#             query_size_value = (min_size, max_size) tuple, or None
+	#             output = file the csv rows are written to, defaults to stdout
+	# Purpose:    Prints results of session queries to console as csv, see
+	#             run_session_queries().
+	# =========================================================================
+	def run_queries(self, query_path_value=None, query_hash_value=None, query_size_value=None, output=None):
+		run_session_queries(self.config_file_path, query_path_value, query_hash_value, query_size_value, output)
+	# =========================================================================
+	# Name:       load_live_files(work)
+	# Arguments:  work = connection to the verify work database
+	# Purpose:    Discovers current files of the session target into the work
+	#             database so they can be read back sorted by path.
+	# =========================================================================
+	def load_live_files(self, work):
+		work.executescript("""
+			CREATE TABLE live (Location TEXT, Name TEXT, Size INTEGER, Created INTEGER, Modified INTEGER);
+			CREATE TABLE added (Location TEXT, Name TEXT, Size INTEGER, Created INTEGER, Modified INTEGER);
+			CREATE TABLE removed (Location TEXT, Name TEXT, Size INTEGER, Hash TEXT, Matched INTEGER DEFAULT 0);""")
+		if os.path.isfile(self.target_path):
+			current_file_info = get_file_info(self.target_path)
+			live_files = iter([[current_file_info] if current_file_info is not None else []])
+		else:
+			live_files = self.walk_directories(self.target_path)
+		for directory_files in live_files:
+			work.executemany("INSERT INTO live VALUES (?, ?, ?, ?, ?)", [current_file_info[:5] for current_file_info in directory_files])
+		work.executescript("""
+			CREATE INDEX live_path ON live (Location, Name);
+			CREATE INDEX removed_size ON removed (Size, Matched);""")
+	# =========================================================================
+	# Name:       verify_batch(changed_files)
+	# Arguments:  changed_files = list of (live row, baseline row) to hash
+	# Purpose:    Hashes files again and saves the ones whose hash changed.
+	# =========================================================================
+	def verify_batch(self, changed_files):
+		file_paths = [os.path.join(live_row[0], live_row[1]) for live_row, baseline_row in changed_files]
+		for (live_row, baseline_row), file_hash in zip(changed_files, self.hasher.map_full(file_paths)):
+			self._verify_stats["read"] += 1
+			if file_hash is not None and file_hash == baseline_row[4]:
+				self._verify_stats["unchanged"] += 1
+			else:
+				self.verify_saving("Modified", live_row, file_hash, baseline_row)
+		del changed_files[:]
+	# =========================================================================
+	# Name:       verify_moves(work, added_files)
+	# Arguments:  work = connection to the verify work database
+	#             added_files = list of added rows that share size with a removed file
+	# Purpose:    Saves added files as moved when a removed file had the same hash.
+	# =========================================================================
+	def verify_moves(self, work, added_files):
+		file_paths = [os.path.join(live_row[0], live_row[1]) for live_row in added_files]
+		for live_row, file_hash in zip(added_files, self.hasher.map_full(file_paths)):
+			self._verify_stats["read"] += 1
+			removed_row = None
+			if file_hash is not None:
+				removed_row = work.execute("SELECT rowid, Location, Name, Size, Hash FROM removed WHERE Size=? AND Matched=0 AND Hash=? LIMIT 1",
+					(live_row[2], file_hash)).fetchone()
+			if removed_row is not None:
+				work.execute("UPDATE removed SET Matched=1 WHERE rowid=?", (removed_row[0],))
+				self.verify_saving("Moved", live_row, file_hash, [removed_row[1], removed_row[2], removed_row[3], None, removed_row[4]])
+			else:
+				self.verify_saving("Added", live_row, file_hash)
+		del added_files[:]
+	# =========================================================================
+	# Name:       verify_saving(status, live_row, file_hash, baseline_row)
+	# Arguments:  status = Added, Removed, Modified or Moved
+	#             live_row = current file row or None for removed files
+	#             file_hash = current hash, None if it wasn't calculated
+	#             baseline_row = row from the baseline session or None
+	# Purpose:    Saves a changed file to the verify report.
+	# =========================================================================
+	def verify_saving(self, status, live_row, file_hash, baseline_row=None):
+		self._verify_stats[status.lower()] += 1
+		if live_row is None:
+			verify_row = ["", "", baseline_row[2], ""]
+		else:
+			verify_row = [live_row[0], live_row[1], live_row[2], file_hash or ""]
+		if baseline_row is None:
+			verify_row += ["", "", ""]
+		else:
+			verify_row += [baseline_row[0], baseline_row[1], baseline_row[4] or ""]
+		self.csv_saving(self.verify_list_path, [status] + verify_row)
+	# =========================================================================
+	# Name:       verify_session(paranoid)
+	# Arguments:  paranoid = True to hash files even if size and time didn't change
+	# Purpose:    Compares the loaded session (baseline) with the files currently
+	#             in its target and saves changes to 'verify_<date>.csv'. Both
+	#             sides are read sorted by path from SQLite and joined as streams,
+	#             added and removed files are kept on disk until moves are found,
+	#             so memory stays flat regardless of the number of files.
+	# =========================================================================
+	def verify_session(self, paranoid=False):
+		verify_datetime = str(strftime("%Y-%m-%d@%H-%M-%S", localtime()))
+		self.verify_list_path = create_report_path(self.results_dir_path, "verify_{}".format(verify_datetime), ".csv")
+		work_path = os.path.splitext(self.verify_list_path)[0] + ".sqlite"
+		if os.path.isfile(work_path):
+			# Left by a verify that was stopped, its report name is free again
+			os.remove(work_path)
+
+		baseline = self.open_index()
+		work = sqlite3.connect(work_path)
+		try:
+			self.load_live_files(work)
+			csv_format_header = ["Status", "Location", "Name", "Size", "Hash", "Previous Location", "Previous Name", "Previous Hash"]
+			self.csv_saving(self.verify_list_path, csv_format_header)
+
+			baseline_rows = baseline.execute("""SELECT f.Location, f.Name, f.Size, f.Modified, h.digest FROM files f
+				LEFT JOIN hashes h ON h.file_id=f.id AND h.column='Hash' ORDER BY f.Location, f.Name""")
+			live_rows = work.execute("SELECT Location, Name, Size, Created, Modified FROM live ORDER BY Location, Name")
+			baseline_row, live_row = next(baseline_rows, None), next(live_rows, None)
+			changed_files = []
+
+			while baseline_row is not None or live_row is not None:
+				if live_row is None or (baseline_row is not None and tuple(baseline_row[:2]) < tuple(live_row[:2])):
+					work.execute("INSERT INTO removed (Location, Name, Size, Hash) VALUES (?, ?, ?, ?)",
+						(baseline_row[0], baseline_row[1], baseline_row[2], baseline_row[4]))
+					baseline_row = next(baseline_rows, None)
+				elif baseline_row is None or tuple(live_row[:2]) < tuple(baseline_row[:2]):
+					work.execute("INSERT INTO added VALUES (?, ?, ?, ?, ?)", live_row)
+					live_row = next(live_rows, None)
+				else:
+					if paranoid or baseline_row[2] != live_row[2] or baseline_row[3] != live_row[4]:
+						changed_files.append((live_row, baseline_row))
+						if len(changed_files) >= _verify_batch_rows:
+							self.verify_batch(changed_files)
+					else:
+						self._verify_stats["unchanged"] += 1
+					baseline_row, live_row = next(baseline_rows, None), next(live_rows, None)
+			self.verify_batch(changed_files)
+
+			# Added files can only be moves of removed files with the same size
+			added_files = []
+			for added_row in work.execute("SELECT a.* FROM added a WHERE NOT EXISTS (SELECT 1 FROM removed r WHERE r.Size=a.Size)"):
+				self.verify_saving("Added", added_row, None)
+			for added_row in work.execute("SELECT a.* FROM added a WHERE EXISTS (SELECT 1 FROM removed r WHERE r.Size=a.Size)"):
+				added_files.append(added_row)
+				if len(added_files) >= _verify_batch_rows:
+					self.verify_moves(work, added_files)
+			self.verify_moves(work, added_files)
+
+			for removed_row in work.execute("SELECT Location, Name, Size, NULL, Hash FROM removed WHERE Matched=0"):
+				self.verify_saving("Removed", None, None, removed_row)
+		finally:
+			self.csv_closing(self.verify_list_path)
+			baseline.close()
+			work.close()
+			os.remove(work_path)
+		self.display_verify_status()
+	# =========================================================================
+	# Name:       display_verify_status()
+	# Purpose:    Displays formatted console output with verify statistics.
+	# =========================================================================
+	def display_verify_status(self):
+		for status in ["Unchanged", "Modified", "Moved", "Added", "Removed"]:
+			print ("{:<2}{:<25}{:<10}".format('',status, str(self._verify_stats[status.lower()])))
+		print ("{:<2}{:<25}{:<10}".format('',"Files read", str(self._verify_stats["read"])))
+		print ("{:<2}{:<25}{:<10}".format('',"Verify list", self.verify_list_path))
+		print ("{:<2}{:<25}".format('','======================================================================='))
+	# =========================================================================
+	# Name:       bench_discovery(tree_path)
+	# Purpose:    Discovers all files in a tree with the session discovery engine.
+	# =========================================================================
+	def bench_discovery(self, tree_path):
+		for directory_files in self.walk_directories(tree_path, True, False):
+			pass
+	# =========================================================================
+	# Name:       bench_csv_writer(csv_path)
+	# Purpose:    Saves benchmark rows through the session csv writer, in csv or
+	#             binary format depending on the extension of csv_path.
+	# =========================================================================
+	def bench_csv_writer(self, csv_path):
+		row_data = ["/bench/location/of/the/file", "file_name.bin", 123456, 1700000000, 1700000000, "0123456789abcdef" * 2]
+		self.csv_saving(csv_path, ["Location", "Name", "Size","Created","Modified","Hash"])
+		for number in range(_bench_csv_rows):
+			self.csv_saving(csv_path, row_data)
+		self.csv_closing(csv_path)
+	# =========================================================================
+	# Name:       run_benchmarks()
+	# Purpose:    Runs benchmarks inside the target directory and saves results to
+	#             'bench_<date>.json' for comparing releases.
+	# =========================================================================
+	def run_benchmarks(self):
+		if not os.path.isdir(self.target_path):
+			raise ValueError('\n\n>>>>> Benchmarks need a directory as target!\n')
+
+		bench_results = []
+		bench_path = tempfile.mkdtemp(prefix="hashpy_bench_", dir=self.target_path)
+		try:
+			trees = collections.OrderedDict((tree_name, generate_bench_tree(bench_path, tree_name)) for tree_name in ["tiny", "huge", "deep"])
+
+			for tree_name, (tree_path, files, size) in trees.items():
+				bench_measure(bench_results, "discovery/{}".format(tree_name), lambda: self.bench_discovery(tree_path), files, None, False)
+
+			for tree_name, (tree_path, files, size) in trees.items():
+				bench_measure(bench_results, "hash/{}/MD5".format(tree_name), lambda: bench_hashing(tree_path, "MD5", 0, "auto"), files, size)
+
+			tree_path, files, size = trees["huge"]
+			for hash_type in _hash_constructors:
+				for chunk_size in _bench_chunk_sizes:
+					bench_measure(bench_results, "hash/huge/{}/read/{}K".format(hash_type, chunk_size // 1024),
+						lambda: bench_hashing(tree_path, hash_type, chunk_size, "read"), files, size)
+				bench_measure(bench_results, "hash/huge/{}/mmap".format(hash_type),
+					lambda: bench_hashing(tree_path, hash_type, 0, "mmap"), files, size)
+
+			csv_path = os.path.join(bench_path, "bench.csv")
+			bench_measure(bench_results, "csv/writer", lambda: self.bench_csv_writer(csv_path), _bench_csv_rows,
+				lambda: os.path.getsize(csv_path))
+			binary_path = os.path.join(bench_path, "bench.hpb")
+			bench_measure(bench_results, "binary/writer", lambda: self.bench_csv_writer(binary_path), _bench_csv_rows,
+				lambda: os.path.getsize(binary_path))
+			bench_measure(bench_results, "csv/reader", lambda: collections.deque(read_list(csv_path), 0), _bench_csv_rows, os.path.getsize(csv_path))
+			bench_measure(bench_results, "binary/reader", lambda: collections.deque(read_list(binary_path), 0), _bench_csv_rows, os.path.getsize(binary_path))
+		finally:
+			shutil.rmtree(bench_path, ignore_errors=True)
+
+		bench_list_path = os.path.join(self.results_dir_path, "bench_{}.json".format(self.session_datetime))
+		os.makedirs(self.results_dir_path, exist_ok=True)
+		with open(bench_list_path, 'w', encoding='utf8') as f:
+			json.dump(collections.OrderedDict([
+				("session_datetime", self.session_datetime),
+				("python", platform.python_version()),
+				("platform", platform.platform()),
+				("target", os.path.abspath(self.target_path)),
+				("results", bench_results),
+			]), f, indent=2)
+		print ("{:<2}{:<25}".format('','======================================================================='))
+		print ("{:<2}{:<25}{:<10}".format('',"Benchmark results", bench_list_path))
+		print ("{:<2}{:<25}".format('','======================================================================='))
 # =============================================================================
-# Name:       run_app
+# Name:       run_app(argv)
+# Arguments:  argv = command line arguments, defaults to sys.argv
 # Purpose:    starts off all required funcitions.
 # =============================================================================
-def run_app():
-	args = parser.parse_args()
-	update_settings(args)
-	print_settings()
-	file_discovery()
-	save_settings()
-	file_hasher()
+def run_app(argv=None):
+	parser = build_parser()
+	args = parser.parse_args(argv)
+	if args.convert is not None:
+		if not os.path.isfile(args.target):
+			parser.error('\n\n>>>>> Convert needs a session list as target!\n')
+		converted_rows = convert_list(args.target, args.convert)
+		print ("{:<2}{:<25}{:<10}".format('',"Converted rows", str(max(converted_rows - 1, 0))))
+		print ("{:<2}{:<25}{:<10}".format('',"Converted list", os.path.abspath(args.convert)))
+		return
+	session_loaded = is_session_config(args.target)
+	if args.query_path is not None or args.query_hash is not None or args.query_size is not None:
+		if session_loaded == False:
+			parser.error('\n\n>>>>> Queries need a session HashPy.config as target!\n')
+		# Session isn't loaded, its target may be gone
+		run_session_queries(args.target, args.query_path, args.query_hash, args.query_size)
+		return
+	if args.verify and session_loaded == False:
+		parser.error('\n\n>>>>> Verify needs a baseline session HashPy.config as target!\n')
+	if args.bench and session_loaded == False and not os.path.isdir(args.target):
+		parser.error('\n\n>>>>> Benchmarks need a directory as target!\n')
+
+	try:
+		if session_loaded:
+			session = Session.load(args.target)
+		else:
+			session = Session(args.target,
+				recursive=args.recursive,
+				verbose=args.verbose,
+				cache_mode=args.cache_mode if args.cache_mode is not None else "off",
+				discovery_workers=args.discovery_workers if args.discovery_workers is not None else 1,
+				stream=args.stream,
+				metrics_file=args.metrics_file,
+				list_format=args.format if args.format is not None else "csv",
+				include=args.include,
+				exclude=args.exclude,
+				min_size=args.min_size,
+				max_size=args.max_size,
+				one_file_system=args.one_file_system,
+				max_depth=args.max_depth,
+				follow_symlinks=args.follow_symlinks if args.follow_symlinks is not None else "files",
+				hash_type=args.hash_type if args.hash_type is not None else "MD5",
+				workers=args.workers if args.workers is not None else 1,
+				pool_type=args.pool if args.pool is not None else "thread",
+				chunk_size=args.chunk_size if args.chunk_size is not None else 0,
+				io_mode=args.io_mode if args.io_mode is not None else "auto",
+				device_workers=dict(args.device_workers or []))
+	except ValueError as error:
+		# Loaded settings are only checked once the session is created
+		print(error)
+		sys.exit(1)
+	# Rows saved so far are kept when interrupted, for resuming the session
+	with session:
+		session.print_settings()
+		if args.bench:
+			if not os.path.isdir(session.target_path):
+				parser.error('\n\n>>>>> Benchmarks need a directory as target!\n')
+			session.run_benchmarks()
+		elif args.verify:
+			session.verify_session(args.paranoid)
+		else:
+			session.run(args.dedupe)
 # =============================================================================
 # Name:       main
 # Purpose:    Starts runApp() and listens for keyboard interrupt to end script
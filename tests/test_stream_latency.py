@@ -0,0 +1,71 @@
+import os, sys, time, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import HashPy
+
+_scan_delay = 0.25			# Seconds every directory scan takes
+_scan_dirs = 8				# Sub directories of the test tree
+
+# =============================================================================
+# Name:       StreamLatencyTest
+# Purpose:    With --stream the first file has to be hashed as soon as it is
+#             discovered, not once the hashing queues are full or discovery
+#             has finished. scan_directory() is slowed down so discovery
+#             takes about (_scan_dirs + 1) * _scan_delay seconds.
+# =============================================================================
+class StreamLatencyTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tree_path = tempfile.mkdtemp(prefix="hashpy_tree_")
+		self.local_path = tempfile.mkdtemp(prefix="hashpy_sessions_")
+		for dir_number in range(_scan_dirs):
+			dir_path = os.path.join(self.tree_path, "dir{}".format(dir_number))
+			os.makedirs(dir_path)
+			# Small files go through the batched fast path, larger ones are single jobs
+			for file_name, file_size in [("small.bin", 100), ("large.bin", HashPy._fast_path_limit + 1)]:
+				with open(os.path.join(dir_path, file_name), 'wb') as f:
+					f.write(os.urandom(file_size))
+		self.scan_directory = HashPy.scan_directory
+		def slow_scan_directory(*args, **kwargs):
+			time.sleep(_scan_delay)
+			return self.scan_directory(*args, **kwargs)
+		HashPy.scan_directory = slow_scan_directory
+
+	def tearDown(self):
+		HashPy.scan_directory = self.scan_directory
+		shutil.rmtree(self.tree_path, ignore_errors=True)
+		shutil.rmtree(self.local_path, ignore_errors=True)
+
+	# =========================================================================
+	# Name:       measure_first_hash(workers)
+	# Purpose:    Returns (seconds to the first hashed file, total seconds)
+	# =========================================================================
+	def measure_first_hash(self, workers):
+		session = HashPy.Session(self.tree_path, recursive=True, stream=True, workers=workers, local_path=self.local_path)
+		first_hash = []
+		file_hashed_saving = session.file_hashed_saving
+		def timed_saving(hashed_file_data):
+			if not first_hash and hashed_file_data[0] != "Location":
+				first_hash.append(time.perf_counter() - start)
+			file_hashed_saving(hashed_file_data)
+		session.file_hashed_saving = timed_saving
+
+		start = time.perf_counter()
+		with session:
+			session.run()
+		self.assertEqual(session._hashed_files_count - 1, _scan_dirs * 2)
+		return first_hash[0], time.perf_counter() - start
+
+	def check_first_hash(self, workers):
+		first_hash, total = self.measure_first_hash(workers)
+		# First directory is scanned after the target, a few scans of slack
+		self.assertLess(first_hash, _scan_delay * 4, "first hash after {:.2f}s of {:.2f}s".format(first_hash, total))
+
+	def test_first_hash_serial(self):
+		self.check_first_hash(1)
+
+	def test_first_hash_parallel(self):
+		self.check_first_hash(4)
+
+if __name__ == '__main__':
+	unittest.main()